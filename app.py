@@ -1,18 +1,171 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
+from functools import lru_cache
+import json
+import os
+import pickle
+import threading
+import time
 import folium
+from branca.element import MacroElement
+from jinja2 import Template
+import numpy as np
 import pandas as pd
-from shapely import wkt
-import pickle
+import shapely
+from shapely.geometry import mapping
+from app_bundle import (
+    LOD_TOLERANCES, SharedServiceIndex, add_lod_geometries, bundle_path, load_app_bundle,
+    load_bus_mrt_combined_gdf, load_mrt_lines, lod_column, mrt_bundle_path, read_bundle_metadata,
+    read_shared_bundle_metadata, shared_bundle_path, simplify_lod, source_paths, split_mrt_lines,
+    stale_sources
+)
+from app_metrics import init_metrics, span
+from projection import to_wgs84
 
 app = Flask(__name__)
 
-def plot_bus_service_and_mrt_routes(service_no, gdf, alternative_service_no=None):
+# Colours of the MRT lines on the map
+MRT_LINE_COLORS = {
+    'NS Line': 'red',
+    'EW Line': 'green',
+    'DT Line': 'darkblue',
+    'CC Line': 'yellow',
+    'NE Line': 'purple',
+    'TE Line': 'brown'
+}
+
+# Highest map zoom level each level-of-detail tier is served at, coarsest first (see app_bundle.LOD_TOLERANCES).
+# Around Singapore a screen pixel covers about 75 m at zoom 11, 19 m at zoom 13 and 5 m at zoom 15,
+# so the simplification of each tier stays below about a pixel.
+LOD_MAX_ZOOMS = [11, 13, 15, None]
+
+# Zoom level assumed when a request does not give one, the zoom level of a single bus route
+DEFAULT_ZOOM = 13
+
+# Decimal places kept for longitude / latitude in served GeoJSON, about 1 m
+COORDINATE_DECIMALS = 5
+
+# Where the browser fetches the MRT base layer from
+MRT_LAYER_URL = '/mrt_layer.geojson'
+
+# Styles of the main and alternative bus routes on the map
+MAIN_ROUTE_STYLE = {'color': 'black', 'weight': 3}
+ALTERNATIVE_ROUTE_STYLE = {'color': 'blue', 'weight': 3, 'dashArray': '5, 5'}
+
+# Number of rendered responses kept in memory; there are about 500 bus services
+ROUTE_CACHE_SIZE = 1024
+
+# How often (in seconds) the inputs are checked for changes
+DATASET_CHECK_INTERVAL = 5
+
+# Errors of a missing, half-written or malformed input file, which leave the loaded data in place
+DATASET_LOAD_ERRORS = (OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError)
+
+# Set WARM_ROUTE_CACHE=1 to render every bus service when the app starts
+WARM_ROUTE_CACHE = os.getenv('WARM_ROUTE_CACHE', '0') == '1'
+
+# Set SHARED_DATASET=1 when running several workers: the bus services are then read from the
+# memory-mapped Arrow file of the app bundle, which all workers share, instead of each worker
+# holding its own copy
+SHARED_DATASET = os.getenv('SHARED_DATASET', '0') == '1'
+
+class StaticGeoJsonLayer(MacroElement):
+    """
+    Adds a GeoJSON layer that the browser fetches from url, instead of embedding it in the map HTML.
+    Each feature is styled with its 'style' property and listed in layer_control under its 'name' property.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        fetch({{ this.url|tojson }})
+            .then(response => response.json())
+            .then(data => {
+                data.features.forEach(feature => {
+                    const layer = L.geoJSON(feature, {style: feature.properties.style})
+                        .addTo({{ this._parent.get_name() }});
+                    {{ this.layer_control.get_name() }}.addOverlay(layer, feature.properties.name);
+                });
+            });
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, layer_control):
+        super().__init__()
+        self._name = 'StaticGeoJsonLayer'
+        self.url = url
+        self.layer_control = layer_control
+
+def get_lod_tier(zoom):
+    # The level-of-detail tier to serve at a map zoom level
+    for tier, max_zoom in enumerate(LOD_MAX_ZOOMS):
+        if max_zoom is None or zoom <= max_zoom:
+            return tier
+    return len(LOD_MAX_ZOOMS) - 1
+
+def get_request_lod_tier():
+    # The tier matching the 'zoom' query parameter of the current request
+    return get_lod_tier(request.args.get('zoom', DEFAULT_ZOOM, type=float))
+
+def to_display_geometry(geom, crs):
+    """
+    Prepares a geometry for the browser: converted to longitude / latitude and rounded to COORDINATE_DECIMALS.
+
+    Parameters:
+    - geom: shapely geometry, in crs.
+    - crs: the CRS of geom.
+
+    Returns:
+    - The geometry as a GeoJSON-like dict.
+    """
+    geom = to_wgs84(geom, crs)
+    geom = shapely.transform(geom, lambda coords: np.round(coords, COORDINATE_DECIMALS))
+    return mapping(geom)
+
+def build_mrt_base_layer(mrt_geoms, tolerance):
+    """
+    Serialises the MRT lines once, as a simplified GeoJSON FeatureCollection in longitude / latitude.
+
+    Parameters:
+    - mrt_geoms: GeoSeries, the MRT line geometries indexed by column name (see app_bundle.split_mrt_lines).
+    - tolerance: float, simplification tolerance in metres (see app_bundle.simplify_lod).
+
+    Returns:
+    - The FeatureCollection as a JSON string.
+    """
+    mrt_geoms = mrt_geoms.copy()
+    mrt_geoms[:] = simplify_lod(mrt_geoms.values, mrt_geoms.crs, tolerance)
+    features = []
+    for line_name, color in MRT_LINE_COLORS.items():
+        mrt_geom = mrt_geoms.get(f"{line_name.split()[0]}_MRT_geom")
+        if mrt_geom is None or mrt_geom.is_empty:
+            continue
+        features.append({
+            'type': 'Feature',
+            'properties': {'name': line_name, 'style': {'color': color, 'weight': 2}},
+            'geometry': to_display_geometry(mrt_geom, mrt_geoms.crs),
+        })
+    return json.dumps({'type': 'FeatureCollection', 'features': features}, separators=(',', ':'))
+
+def build_service_index(gdf):
+    """
+    Maps every ServiceNo to its row, so a request can look a service up without scanning the GeoDataFrame.
+
+    Parameters:
+    - gdf: GeoDataFrame, contains the bus routes data.
+
+    Returns:
+    - A dict from ServiceNo to the first row (a Series) with that ServiceNo.
+    """
+    first_rows = gdf.drop_duplicates(subset='ServiceNo', keep='first')
+    return {row['ServiceNo']: row for _, row in first_rows.iterrows()}
+
+def plot_bus_service_and_mrt_routes(service_no, service_index, crs, alternative_service_no=None):
     """
     Plots the bus routes and MRT lines for a given ServiceNo using Folium.
+    The MRT lines are not embedded; the map fetches the cached base layer from MRT_LAYER_URL.
 
     Parameters:
     - service_no: str, the main bus service number to plot.
-    - gdf: GeoDataFrame, contains the bus and MRT routes data.
+    - service_index: dict, maps ServiceNo to its row (see build_service_index).
+    - crs: the CRS of the route geometries.
     - alternative_service_no: str, optional, the alternative bus service number to plot, alternate service will be used in the main html plot.
 
     Returns:
@@ -21,32 +174,17 @@ def plot_bus_service_and_mrt_routes(service_no, gdf, alternative_service_no=None
     # Initialize the map centered on Singapore
     singapore_coords = [1.3521, 103.8198]
     m = folium.Map(location=singapore_coords, zoom_start=12, control_scale=True)
+    layer_control = folium.LayerControl(collapsed=False)
 
-    # Plot MRT lines
-    line_colors = {
-        'NS Line': 'red',
-        'EW Line': 'green',
-        'DT Line': 'darkblue',
-        'CC Line': 'yellow',
-        'NE Line': 'purple',
-        'TE Line': 'brown'
-    }
-
-    for line_name, color in line_colors.items():
-        geom_col = f"{line_name.split()[0]}_MRT_geom"
-        mrt_geom = gdf.iloc[0][geom_col]
-        if mrt_geom and not mrt_geom.is_empty:
-            folium.GeoJson(
-                mrt_geom,
-                name=line_name,
-                style_function=lambda x, color=color: {'color': color, 'weight': 2}
-            ).add_to(m)
+    # Plot MRT lines from the static base layer
+    StaticGeoJsonLayer(MRT_LAYER_URL, layer_control).add_to(m)
 
     # Plot main bus route
     if service_no:
-        row = gdf[gdf['ServiceNo'] == service_no]
-        if not row.empty:
-            bus_route = row.iloc[0]['geometry']
+        row = service_index.get(service_no)
+        if row is not None:
+            # Geometries are stored in SVY21 and only converted to lat/lon for display
+            bus_route = to_wgs84(row['geometry'], crs)
             if bus_route and not bus_route.is_empty:
                 # Center the map on the bus route
                 m.location = [bus_route.centroid.y, bus_route.centroid.x]
@@ -56,7 +194,7 @@ def plot_bus_service_and_mrt_routes(service_no, gdf, alternative_service_no=None
                 folium.GeoJson(
                     bus_route,
                     name=route_name,
-                    style_function=lambda x: {'color': 'black', 'weight': 3}
+                    style_function=lambda x: MAIN_ROUTE_STYLE
                 ).add_to(main_bus_route_fg)
                 main_bus_route_fg.add_to(m)
         else:
@@ -64,25 +202,26 @@ def plot_bus_service_and_mrt_routes(service_no, gdf, alternative_service_no=None
 
     # Plot alternative bus route
     if alternative_service_no:
-        alt_row = gdf[gdf['ServiceNo'] == alternative_service_no]
-        if not alt_row.empty:
-            alt_bus_route = alt_row.iloc[0]['geometry']
+        alt_row = service_index.get(alternative_service_no)
+        if alt_row is not None:
+            alt_bus_route = to_wgs84(alt_row['geometry'], crs)
             if alt_bus_route and not alt_bus_route.is_empty:
                 alt_route_name = f"Alternate Bus Route: {alternative_service_no}"
                 alternative_bus_route_fg = folium.FeatureGroup(name=alt_route_name, overlay=True, control=True)
                 folium.GeoJson(
                     alt_bus_route,
                     name=alt_route_name,
-                    style_function=lambda x: {'color': 'blue', 'weight': 3, 'dashArray': '5, 5'}
+                    style_function=lambda x: ALTERNATIVE_ROUTE_STYLE
                 ).add_to(alternative_bus_route_fg)
                 alternative_bus_route_fg.add_to(m)
         else:
             print(f"No data found for Alternative ServiceNo: {alternative_service_no}")
 
     # Add Layer Control
-    folium.LayerControl(collapsed=False).add_to(m)
+    layer_control.add_to(m)
 
-    return m._repr_html_()
+    with span('folium_render'):
+        return m._repr_html_()
 
 def get_overlap_messages(row):
     # Extract MRT overlap percentages
@@ -129,49 +268,222 @@ def get_bus_category(row):
     else:
         return 'UNDEFINED'
 
+def get_dataset_paths():
+    # The prebuilt bundle (see app_bundle.py) if there is one, otherwise the pickle and CSVs it is built from
+    if SHARED_DATASET:
+        return [shared_bundle_path, mrt_bundle_path]
+    if os.path.exists(bundle_path):
+        return [bundle_path, mrt_bundle_path]
+    return source_paths
+
+def get_dataset_version():
+    """
+    Identifies the current version of the app's input files by their modification time and size.
+    Cached responses are tied to this version. The source files are part of it even when the app
+    serves the bundle, so a bundle left behind by newer sources is noticed (see load_app_data).
+    """
+    version = []
+    for path in get_dataset_paths():
+        stat = os.stat(path)
+        version.append((path, stat.st_mtime_ns, stat.st_size))
+    for path in source_paths:
+        # Sources are optional when serving the bundle, e.g. on a server shipped with the bundle only
+        if path not in get_dataset_paths():
+            stat = os.stat(path) if os.path.exists(path) else None
+            version.append((path, stat and stat.st_mtime_ns, stat and stat.st_size))
+    return tuple(version)
+
+def load_app_data():
+    """
+    Loads the bus services and the MRT lines, from the app bundle when it exists.
+
+    Returns:
+    - service_index: dict-like, maps ServiceNo to its row (a SharedServiceIndex when SHARED_DATASET is set).
+    - crs: the CRS of the bus route geometries.
+    - mrt_geoms: GeoSeries, the MRT lines, held once rather than on every row.
+    """
+    path = shared_bundle_path if SHARED_DATASET else bundle_path
+    stale = []
+    if os.path.exists(path):
+        # A bundle built before the notebooks last wrote their outputs would serve outdated data
+        metadata = read_shared_bundle_metadata(path) if SHARED_DATASET else read_bundle_metadata(path)
+        stale = stale_sources(metadata)
+        if stale:
+            print(
+                f"WARNING: {', '.join(stale)} changed after {path} was built, merging the source files instead. "
+                f"Rebuild the bundle with: python app_bundle.py"
+            )
+
+    if SHARED_DATASET and not stale:
+        service_index = SharedServiceIndex(shared_bundle_path)
+        return service_index, service_index.crs, load_mrt_lines(mrt_bundle_path)
+    if os.path.exists(bundle_path) and not stale:
+        services_gdf, mrt_geoms = load_app_bundle(bundle_path, mrt_bundle_path)
+    else:
+        if not stale:
+            print(f"{bundle_path} not found, merging the source files instead. Build it with: python app_bundle.py")
+        services_gdf, mrt_geoms = split_mrt_lines(load_bus_mrt_combined_gdf())
+        services_gdf = add_lod_geometries(services_gdf)
+
+    # Look services up by ServiceNo in constant time instead of filtering the GeoDataFrame on every request
+    return build_service_index(services_gdf), services_gdf.crs, mrt_geoms
+
+dataset_lock = threading.Lock()
+dataset_checked_at = 0.0
+
+def load_dataset():
+    """
+    (Re)loads the app's data and clears every cached response built from the previous version.
+    """
+    global service_index, data_crs, mrt_base_layers, dataset_version
+    version = get_dataset_version()
+    new_service_index, new_data_crs, mrt_geoms = load_app_data()
+
+    # The MRT lines never change between requests, so they are simplified and serialised once per level of detail
+    new_mrt_base_layers = [build_mrt_base_layer(mrt_geoms, tolerance) for tolerance in LOD_TOLERANCES]
+
+    # Swapped in only once everything has loaded, so a failed reload leaves the previous version in place
+    service_index, data_crs, mrt_base_layers = new_service_index, new_data_crs, new_mrt_base_layers
+    dataset_version = version
+    build_bus_route_response.cache_clear()
+    build_bus_route_data.cache_clear()
+
+def refresh_dataset():
+    """
+    Reloads the data if the input files have changed. The files are checked at most every DATASET_CHECK_INTERVAL seconds.
+    If an input file is missing or cannot be loaded (e.g. it is still being written), the loaded version keeps
+    being served and the files are checked again after the next interval.
+    """
+    global dataset_checked_at
+    if time.monotonic() - dataset_checked_at < DATASET_CHECK_INTERVAL:
+        return
+    with dataset_lock:
+        if time.monotonic() - dataset_checked_at < DATASET_CHECK_INTERVAL:
+            return
+        try:
+            if get_dataset_version() != dataset_version:
+                print("Input data changed, reloading.")
+                load_dataset()
+        except DATASET_LOAD_ERRORS as e:
+            print(f"Could not reload the input data, still serving the loaded version: {e!r}")
+        dataset_checked_at = time.monotonic()
+
+def get_alternative_service_no(row):
+    # Get the first alternative bus service number
+    # This is the most overlapped service
+    alternative_service_no = row.get('Top_1_Alternative_Bus', None)
+    if pd.notnull(alternative_service_no):
+        return str(alternative_service_no)  # Ensure it's a string
+    return None
+
+@lru_cache(maxsize=ROUTE_CACHE_SIZE)
+def build_bus_route_response(service_no, alternative_service_no, version):
+    """
+    Builds the /get_bus_route response for a bus service. Responses are cached by
+    (service_no, alternative_service_no, version) and the least recently used ones are evicted first.
+
+    Parameters:
+    - service_no: str, a bus service number in service_index.
+    - alternative_service_no: str, the alternative bus service to plot, or None.
+    - version: tuple, the dataset version the response is built from (see get_dataset_version).
+
+    Returns:
+    - A dict with the map HTML, the bus category and the overlap messages.
+    """
+    row = service_index[service_no]
+    with span('overlap_messages'):
+        bus_category = get_bus_category(row)
+        mrt_overlap_messages, alt_bus_routes = get_overlap_messages(row)
+
+    # Building and rendering the map; the rendering alone is also timed, as folium_render
+    with span('folium_map'):
+        bus_route_map = plot_bus_service_and_mrt_routes(
+            service_no, service_index, data_crs, alternative_service_no
+        )
+
+    return {
+        'error_message': None,
+        'bus_route_map': bus_route_map,
+        'service_no': service_no,
+        'Category': bus_category,
+        'mrt_overlap_messages': mrt_overlap_messages,
+        'alt_bus_routes': alt_bus_routes
+    }
+
+@lru_cache(maxsize=ROUTE_CACHE_SIZE)
+def build_bus_route_data(service_no, alternative_service_no, lod_tier, version):
+    """
+    Builds the /api/bus_route response for a bus service: the main and alternative routes as simplified
+    GeoJSON, and the overlap statistics. Cached like build_bus_route_response.
+
+    Parameters:
+    - service_no: str, a bus service number in service_index.
+    - alternative_service_no: str, the alternative bus service to include, or None.
+    - lod_tier: int, the level-of-detail tier of the route geometries (see get_lod_tier).
+    - version: tuple, the dataset version the response is built from (see get_dataset_version).
+
+    Returns:
+    - A dict with the routes as a GeoJSON FeatureCollection, the bus category and the overlap messages.
+    """
+    row = service_index[service_no]
+    with span('overlap_messages'):
+        bus_category = get_bus_category(row)
+        mrt_overlap_messages, alt_bus_routes = get_overlap_messages(row)
+
+    features = []
+    routes = [(service_no, 'main', f"Main Bus Route: {service_no}", MAIN_ROUTE_STYLE)]
+    if alternative_service_no in service_index:
+        routes.append((alternative_service_no, 'alternative', f"Alternate Bus Route: {alternative_service_no}", ALTERNATIVE_ROUTE_STYLE))
+    with span('route_geojson'):
+        for route_service_no, role, name, style in routes:
+            bus_route = service_index[route_service_no][lod_column(lod_tier)]
+            if bus_route is None or bus_route.is_empty:
+                continue
+            features.append({
+                'type': 'Feature',
+                'properties': {'service_no': route_service_no, 'role': role, 'name': name, 'style': style},
+                'geometry': to_display_geometry(bus_route, data_crs),
+            })
+
+    return {
+        'error_message': None,
+        'service_no': service_no,
+        'alternative_service_no': alternative_service_no,
+        'Category': bus_category,
+        'mrt_overlap_messages': mrt_overlap_messages,
+        'alt_bus_routes': alt_bus_routes,
+        'lod_tier': lod_tier,
+        'routes': {'type': 'FeatureCollection', 'features': features}
+    }
+
+def warm_route_cache():
+    """
+    Builds the responses of every bus service once, so the first request for each is served from the cache.
+    """
+    start_time = time.time()
+    for service_no, row in service_index.items():
+        alternative_service_no = get_alternative_service_no(row)
+        for lod_tier in range(len(LOD_TOLERANCES)):
+            build_bus_route_data(service_no, alternative_service_no, lod_tier, dataset_version)
+        build_bus_route_response(service_no, alternative_service_no, dataset_version)
+    print(f"Warmed the route cache with {len(service_index)} bus services in {time.time() - start_time:.1f} seconds.")
+
 # Load GeoDataFrame and model data
-file_path = 'data/buffered_bus_mrt_combined_gdf.pkl'
-with open(file_path, 'rb') as f:
-    bus_mrt_combined_gdf = pickle.load(f)
-
-# Rename 'buffered_bus_route_geom' to 'geometry' for consistency
-bus_mrt_combined_gdf.rename(columns={'buffered_bus_route_geom': 'geometry'}, inplace=True)
-
-geom_columns = [
-    'geometry', 'NS_MRT_geom', 'EW_MRT_geom', 'DT_MRT_geom', 'CC_MRT_geom',
-    'NE_MRT_geom', 'TE_MRT_geom'
-]
-
-for col in geom_columns:
-    if bus_mrt_combined_gdf[col].dtype == 'object':
-        first_value = bus_mrt_combined_gdf[col].dropna().iloc[0]
-        if isinstance(first_value, str):
-            bus_mrt_combined_gdf[col] = bus_mrt_combined_gdf[col].apply(wkt.loads)
-
-bus_mrt_combined_gdf['ServiceNo'] = bus_mrt_combined_gdf['ServiceNo'].astype(str)
-
-# Load additional overlap data and merge
-bus_overlap_df = pd.read_csv('data/all_bus_overlaps.csv')
-model_df = pd.read_csv('data/model_df.csv')
-model_df['ServiceNo'] = model_df['ServiceNo'].astype(str)
-final_df = model_df.merge(
-    bus_overlap_df,
-    on='ServiceNo',
-    how='left'
-)
+load_dataset()
+dataset_checked_at = time.monotonic()
 
-bus_mrt_combined_gdf = bus_mrt_combined_gdf.merge(
-    final_df,
-    on='ServiceNo',
-    how='left',
-    suffixes=('', '_overlap')
-)
+if WARM_ROUTE_CACHE:
+    warm_route_cache()
 
-# Save the combined DataFrame for debugging (optional)
-# bus_mrt_combined_gdf.to_csv('data/bus_mrt_combined_gdf.csv', index=False)
+# Request timings, response sizes and cache hits, served at /metrics (see app_metrics.py)
+init_metrics(app, caches={
+    'bus_route_response': build_bus_route_response,
+    'bus_route_data': build_bus_route_data,
+})
 
 @app.route('/', methods=['GET'])
 def index():
+    refresh_dataset()
     sections = [
         {"id": "section1", "image": "image1.png", "text": "This is a map of Singapore."},
         {"id": "section2", "image": "image2.png", "text": "Using data obtained from LTA and OneMapAPI, we mapped out MRT lines in Singapore. The buffered the MRT lines by 400m."},
@@ -188,20 +500,58 @@ def index():
             }
         ]
     }
-    # Render the default map with no bus line first. Only showing the buffered MRT Lines
-    default_map = plot_bus_service_and_mrt_routes(service_no=None, gdf=bus_mrt_combined_gdf)
-
+    # The map is drawn in the browser, starting with the buffered MRT lines only
     return render_template(
         'scrollytelling.html',
         sections=sections,
         main_story_content=main_story_content,
-        bus_route_map=default_map
+        mrt_layer_url=MRT_LAYER_URL,
+        lod_max_zooms=LOD_MAX_ZOOMS
     )
 
+@app.route(MRT_LAYER_URL, methods=['GET'])
+def mrt_layer():
+    refresh_dataset()
+    # Only changes when the input data does, so browsers may keep it but must revalidate it with the ETag
+    # on every use; a reload of the data then reaches them on their next request
+    response = Response(mrt_base_layers[get_request_lod_tier()], mimetype='application/geo+json')
+    response.headers['Cache-Control'] = 'public, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/api/bus_route/<service_no>', methods=['GET'])
+def bus_route_data(service_no):
+    """
+    Returns the main and alternative routes of a bus service as GeoJSON, with its overlap statistics.
+    Used by the route explorer, which draws the routes on its own Leaflet map. The optional 'zoom'
+    query parameter picks the level of detail of the routes.
+    """
+    with span('refresh_dataset'):
+        refresh_dataset()
+
+    service_no = service_no.strip()
+    with span('lookup'):
+        row = service_index.get(service_no)
+    if row is None:
+        return jsonify({
+            'error_message': f"No data found for Bus Service No: {service_no}",
+            'service_no': service_no
+        }), 404
+
+    with span('build_response'):
+        data = build_bus_route_data(
+            service_no, get_alternative_service_no(row), get_request_lod_tier(), dataset_version
+        )
+    with span('serialize'):
+        response = jsonify(data)
+        response.add_etag()
+    return response.make_conditional(request)
+
 @app.route('/get_bus_route', methods=['POST'])
 def get_bus_route():
     """
     Plots the bus routes and MRT lines for a given ServiceNo using Folium.
+    The route explorer uses /api/bus_route instead; this returns the whole map as HTML.
 
     Parameters:
     - No input
@@ -210,41 +560,27 @@ def get_bus_route():
     - A jsonified response.
     - Also includes the alternate bus plot
     """
+    with span('refresh_dataset'):
+        refresh_dataset()
 
     data = request.get_json()
     service_no = data.get('service_no').strip()
-    row_df = bus_mrt_combined_gdf[bus_mrt_combined_gdf['ServiceNo'] == service_no]
+    with span('lookup'):
+        row = service_index.get(service_no)
 
-    if row_df.empty:
+    if row is None:
         response = {
             'error_message': f"No data found for Bus Service No: {service_no}",
             'bus_route_map': '',
             'service_no': service_no
         }
     else:
-        row = row_df.iloc[0]
-        bus_category = get_bus_category(row)
-        mrt_overlap_messages, alt_bus_routes = get_overlap_messages(row)
-
-        # Get the first alternative bus service number
-        # This is the most overlapped service
-        alternative_service_no = row.get('Top_1_Alternative_Bus', None)
-        if pd.notnull(alternative_service_no):
-            alternative_service_no = str(alternative_service_no)  # Ensure it's a string
-        else:
-            alternative_service_no = None
-
-        bus_route_map = plot_bus_service_and_mrt_routes(service_no, bus_mrt_combined_gdf, alternative_service_no)
-
-        response = {
-            'error_message': None,
-            'bus_route_map': bus_route_map,
-            'service_no': service_no,
-            'Category': bus_category,
-            'mrt_overlap_messages': mrt_overlap_messages,
-            'alt_bus_routes': alt_bus_routes
-        }
-    return jsonify(response)
+        alternative_service_no = get_alternative_service_no(row)
+        # Only the first request for a service spends time in the overlap_messages and folium phases
+        with span('build_response'):
+            response = build_bus_route_response(service_no, alternative_service_no, dataset_version)
+    with span('serialize'):
+        return jsonify(response)
 
 if __name__ == '__main__':
     app.run(debug=True)
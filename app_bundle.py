@@ -0,0 +1,301 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import time
+from collections.abc import Mapping
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from pyproj import CRS
+from shapely import wkt
+
+from overlap import MRT_COLUMNS, get_mrt_geometries
+
+# Inputs of the app, as written by data_processing.ipynb and main.ipynb
+gdf_path = 'data/buffered_bus_mrt_combined_gdf.pkl'
+bus_overlap_path = 'data/all_bus_overlaps.csv'
+model_path = 'data/model_df.csv'
+source_paths = [gdf_path, bus_overlap_path, model_path]
+
+# The prebuilt app data: one row per bus service as GeoParquet, with WKB geometries
+bundle_path = 'data/app_bundle.parquet'
+
+# The MRT lines, stored once rather than on every bus service row
+mrt_bundle_path = 'data/app_bundle_mrt.parquet'
+
+# The bus services again as an uncompressed Arrow file, for the shared memory-mapped mode
+shared_bundle_path = 'data/app_bundle.arrow'
+
+# Bumped whenever the layout of the bundle changes, so the app never reads a bundle it does not understand
+BUNDLE_FORMAT_VERSION = 3
+
+# Simplification tolerances (in metres) of the level-of-detail tiers kept for every bus route, coarsest
+# first. A tolerance of 0 keeps every vertex; that tier is the 'geometry' column itself.
+LOD_TOLERANCES = [50, 15, 4, 0]
+
+# Key of the bundle version and input hashes in the GeoDataFrame's attrs, which GeoParquet keeps in the file metadata
+BUNDLE_METADATA_KEY = 'app_bundle'
+
+GEOM_COLUMNS = [
+    'geometry', 'NS_MRT_geom', 'EW_MRT_geom', 'DT_MRT_geom', 'CC_MRT_geom',
+    'NE_MRT_geom', 'TE_MRT_geom'
+]
+
+
+def load_bus_mrt_combined_gdf(gdf_path=gdf_path, bus_overlap_path=bus_overlap_path, model_path=model_path):
+    """
+    Loads the bus and MRT routes and merges in the model data and the alternative bus services.
+
+    Returns:
+    - A GeoDataFrame with one row per bus service and the buffered bus route as 'geometry'.
+    """
+    with open(gdf_path, 'rb') as f:
+        bus_mrt_combined_gdf = pickle.load(f)
+
+    # Rename 'buffered_bus_route_geom' to 'geometry' for consistency
+    bus_mrt_combined_gdf.rename(columns={'buffered_bus_route_geom': 'geometry'}, inplace=True)
+
+    for col in GEOM_COLUMNS:
+        if bus_mrt_combined_gdf[col].dtype == 'object':
+            first_value = bus_mrt_combined_gdf[col].dropna().iloc[0]
+            if isinstance(first_value, str):
+                bus_mrt_combined_gdf[col] = bus_mrt_combined_gdf[col].apply(wkt.loads)
+
+    # Make the renamed column the active geometry again, so that gdf.crs is available when plotting
+    bus_mrt_combined_gdf = bus_mrt_combined_gdf.set_geometry('geometry')
+    for col in GEOM_COLUMNS:
+        if bus_mrt_combined_gdf[col].dtype != 'geometry':
+            bus_mrt_combined_gdf[col] = gpd.GeoSeries(bus_mrt_combined_gdf[col], crs=bus_mrt_combined_gdf.crs)
+
+    bus_mrt_combined_gdf['ServiceNo'] = bus_mrt_combined_gdf['ServiceNo'].astype(str)
+
+    # Load additional overlap data and merge
+    bus_overlap_df = pd.read_csv(bus_overlap_path)
+    model_df = pd.read_csv(model_path)
+    model_df['ServiceNo'] = model_df['ServiceNo'].astype(str)
+    final_df = model_df.merge(
+        bus_overlap_df,
+        on='ServiceNo',
+        how='left'
+    )
+
+    bus_mrt_combined_gdf = bus_mrt_combined_gdf.merge(
+        final_df,
+        on='ServiceNo',
+        how='left',
+        suffixes=('', '_overlap')
+    )
+
+    return bus_mrt_combined_gdf
+
+
+def _file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def split_mrt_lines(bus_mrt_combined_gdf):
+    """
+    Separates the MRT lines, which are repeated on every row, from the bus services.
+
+    Returns:
+    - services_gdf: GeoDataFrame, the bus services without the MRT columns.
+    - mrt_geoms: GeoSeries, one geometry per MRT line, indexed by column name (see overlap.get_mrt_geometries).
+    """
+    return bus_mrt_combined_gdf.drop(columns=MRT_COLUMNS), get_mrt_geometries(bus_mrt_combined_gdf)
+
+
+def lod_column(tier):
+    # The name of the geometry column holding a level-of-detail tier
+    return 'geometry' if LOD_TOLERANCES[tier] == 0 else f'geometry_lod{tier}'
+
+
+def simplify_lod(geoms, crs, tolerance):
+    """
+    Simplifies geometries for one level-of-detail tier, preserving their topology.
+
+    Parameters:
+    - geoms: array-like of shapely geometries.
+    - crs: the CRS of geoms. Longitude / latitude data is left unchanged, as the tolerance is in metres.
+    - tolerance: float, in metres. 0 returns the geometries unchanged.
+
+    Returns:
+    - An array of geometries.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    if tolerance == 0 or crs is None or not CRS(crs).is_projected:
+        return geoms
+    return shapely.simplify(geoms, tolerance, preserve_topology=True)
+
+
+def add_lod_geometries(services_gdf):
+    """
+    Adds one simplified copy of the bus route geometry per level-of-detail tier (see LOD_TOLERANCES),
+    so the app can serve coarse routes when zoomed out without simplifying them per request.
+    """
+    services_gdf = services_gdf.copy()
+    for tier, tolerance in enumerate(LOD_TOLERANCES):
+        if tolerance:
+            services_gdf[lod_column(tier)] = gpd.GeoSeries(
+                simplify_lod(services_gdf.geometry.values, services_gdf.crs, tolerance),
+                index=services_gdf.index, crs=services_gdf.crs
+            )
+    return services_gdf
+
+
+def build_app_bundle(gdf_path=gdf_path, bus_overlap_path=bus_overlap_path, model_path=model_path):
+    """
+    Builds the app bundle from the merged GeoDataFrame the app serves: the bus services as GeoParquet
+    (bundle_path) and as an Arrow file (shared_bundle_path), and the MRT lines once (mrt_bundle_path).
+    Every bus route is stored at each level of detail in LOD_TOLERANCES.
+    The bundle records its format version and the SHA-256 of every input in its metadata.
+
+    Parameters:
+    - gdf_path, bus_overlap_path, model_path: str, the inputs (see load_bus_mrt_combined_gdf).
+
+    Returns:
+    - The bundle metadata, as a dict.
+    """
+    services_gdf, mrt_geoms = split_mrt_lines(load_bus_mrt_combined_gdf(gdf_path, bus_overlap_path, model_path))
+    services_gdf = add_lod_geometries(services_gdf)
+
+    metadata = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'rows': len(services_gdf),
+        'sources': {path: _file_sha256(path) for path in [gdf_path, bus_overlap_path, model_path]},
+    }
+    services_gdf.attrs[BUNDLE_METADATA_KEY] = metadata
+    mrt_gdf = gpd.GeoDataFrame({'line': mrt_geoms.index}, geometry=mrt_geoms.values, crs=mrt_geoms.crs)
+
+    # Each file is written next to its final path and moved into place, so the app never reads a partial file
+    _write_parquet(services_gdf, bundle_path)
+    _write_parquet(mrt_gdf, mrt_bundle_path)
+    _write_shared_table(services_gdf, metadata, shared_bundle_path)
+    print(f"Saved {len(services_gdf)} bus services and {len(mrt_gdf)} MRT lines to {bundle_path}, {mrt_bundle_path} and {shared_bundle_path}.")
+    return metadata
+
+
+def _write_parquet(gdf, path):
+    tmp_path = path + '.tmp'
+    gdf.to_parquet(tmp_path, index=False, geometry_encoding='WKB', compression='zstd')
+    os.replace(tmp_path, path)
+
+
+def _write_shared_table(services_gdf, metadata, path):
+    geometry_columns = [col for col in services_gdf.columns if services_gdf[col].dtype == 'geometry']
+    df = pd.DataFrame(services_gdf)
+    for col in geometry_columns:
+        df[col] = shapely.to_wkb(services_gdf[col].values)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        BUNDLE_METADATA_KEY: json.dumps(metadata),
+        'geometry_columns': json.dumps(geometry_columns),
+        'crs': services_gdf.crs.to_json() if services_gdf.crs is not None else '',
+    })
+
+    # Uncompressed, so the file can be memory-mapped and read without copying
+    tmp_path = path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def read_bundle_metadata(path=bundle_path):
+    # Only the Parquet footer is read, not the data
+    schema_metadata = pq.read_schema(path).metadata or {}
+    attrs = json.loads(schema_metadata.get(b'PANDAS_ATTRS', b'{}'))
+    return attrs.get(BUNDLE_METADATA_KEY)
+
+
+def read_shared_bundle_metadata(path=shared_bundle_path):
+    # Only the Arrow schema is read, not the data
+    with pa.memory_map(path, 'r') as source:
+        schema_metadata = pa.ipc.open_file(source).schema.metadata or {}
+    return json.loads(schema_metadata.get(BUNDLE_METADATA_KEY.encode(), b'null'))
+
+
+def stale_sources(metadata):
+    """
+    Lists the inputs that have changed since the bundle was built, by comparing their SHA-256 with the
+    hashes recorded in its metadata. Inputs that do not exist (e.g. a server shipped with the bundle only)
+    are not checked.
+    """
+    recorded = (metadata or {}).get('sources', {})
+    return [path for path in source_paths if os.path.exists(path) and recorded.get(path) != _file_sha256(path)]
+
+
+def _check_format_version(metadata, path):
+    if metadata is None or metadata['format_version'] != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"{path} is not a version {BUNDLE_FORMAT_VERSION} app bundle, rebuild it with: python app_bundle.py")
+
+
+def load_mrt_lines(path=mrt_bundle_path):
+    """
+    Loads the MRT lines saved by build_app_bundle, as a GeoSeries indexed by column name.
+    """
+    mrt_gdf = gpd.read_parquet(path)
+    return gpd.GeoSeries(mrt_gdf.geometry.values, index=mrt_gdf['line'].values, crs=mrt_gdf.crs)
+
+
+def load_app_bundle(path=bundle_path, mrt_path=mrt_bundle_path):
+    """
+    Loads the app bundle built by build_app_bundle. The file is memory-mapped and the
+    geometries are decoded from WKB in one vectorised pass.
+
+    Returns:
+    - services_gdf: GeoDataFrame, the bus services, without the MRT columns.
+    - mrt_geoms: GeoSeries, the MRT lines (see split_mrt_lines).
+    """
+    _check_format_version(read_bundle_metadata(path), path)
+    return gpd.read_parquet(path, memory_map=True), load_mrt_lines(mrt_path)
+
+
+class SharedServiceIndex(Mapping):
+    """
+    Read-only ServiceNo-to-row lookup over the memory-mapped Arrow file written by build_app_bundle.
+
+    The file is mapped rather than read, so every process that opens it shares the same pages of the
+    OS page cache instead of holding its own copy. Rows are decoded into a Series, with shapely
+    geometries, only when they are looked up.
+    """
+
+    def __init__(self, path=shared_bundle_path):
+        self.table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        schema_metadata = self.table.schema.metadata
+        _check_format_version(json.loads(schema_metadata[BUNDLE_METADATA_KEY.encode()]), path)
+        self.geometry_columns = json.loads(schema_metadata[b'geometry_columns'])
+        self.crs = CRS.from_user_input(schema_metadata[b'crs'].decode()) if schema_metadata[b'crs'] else None
+
+        # Keep the first row of each ServiceNo, like app.build_service_index
+        self.positions = {}
+        for position, service_no in enumerate(self.table.column('ServiceNo').to_pylist()):
+            self.positions.setdefault(service_no, position)
+
+    def __getitem__(self, service_no):
+        row = self.table.slice(self.positions[service_no], 1).to_pylist()[0]
+        for col in self.geometry_columns:
+            row[col] = shapely.from_wkb(row[col])
+        return pd.Series(row)
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the data bundle that app.py loads at startup.")
+    parser.parse_args()
+
+    build_app_bundle()
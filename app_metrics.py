@@ -0,0 +1,242 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+
+# Upper bounds (in seconds) of the latency histogram buckets, the Prometheus client defaults
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Upper bounds (in bytes) of the response size histogram buckets, from 256 B to 16 MB
+SIZE_BUCKETS = [256 * 4 ** i for i in range(9)]
+
+# Where Prometheus scrapes the metrics from
+METRICS_URL = '/metrics'
+
+# Set SAMPLING_PROFILER=1 to sample the stacks of the threads serving requests, readable at PROFILE_URL
+SAMPLING_PROFILER = os.getenv('SAMPLING_PROFILER', '0') == '1'
+
+# Seconds between two stack samples of the sampling profiler
+PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', '0.01'))
+
+PROFILE_URL = '/debug/profile'
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    escaped = [
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in items
+    ]
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else f'{bound:g}'
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms kept in memory and rendered in the Prometheus text format.
+    Metrics are per process, so with several workers each one reports its own.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.descriptions = {}
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = {}
+
+    def counter(self, name, description):
+        self.descriptions[name] = ('counter', description)
+        self.counters[name] = {}
+
+    def histogram(self, name, description, buckets):
+        self.descriptions[name] = ('histogram', description)
+        self.histograms[name] = (list(buckets) + [float('inf')], {})
+
+    def add_collector(self, key, collect):
+        """
+        Adds metrics that are read when the metrics are rendered rather than recorded as they happen.
+        collect() returns a list of (name, type, description, [(labels dict, value)]). Adding a collector
+        again under the same key replaces it.
+        """
+        self.collectors[key] = collect
+
+    def inc(self, name, labels=None, value=1):
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            self.counters[name][key] = self.counters[name].get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = tuple(sorted((labels or {}).items()))
+        buckets, series = self.histograms[name]
+        with self.lock:
+            counts, total = series.get(key, ([0] * len(buckets), 0.0))
+            for position, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[position] += 1
+            series[key] = (counts, total + value)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, series in self.counters.items():
+                kind, description = self.descriptions[name]
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+                lines += [f'{name}{_format_labels(labels)} {value:g}' for labels, value in series.items()]
+            for name, (buckets, series) in self.histograms.items():
+                kind, description = self.descriptions[name]
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+                for labels, (counts, total) in series.items():
+                    for bound, count in zip(buckets, counts):
+                        lines.append(f'{name}_bucket{_format_labels(labels, ("le", _format_bound(bound)))} {count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {total:g}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {counts[-1]}')
+        for collect in list(self.collectors.values()):
+            for name, kind, description, samples in collect():
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+                lines += [f'{name}{_format_labels(sorted(labels.items()))} {value:g}' for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metrics.counter('app_requests_total', 'Requests served, by endpoint, method and status code.')
+metrics.histogram('app_request_duration_seconds', 'Time spent serving a request, by endpoint.', LATENCY_BUCKETS)
+metrics.histogram('app_response_size_bytes', 'Size of the response body, by endpoint.', SIZE_BUCKETS)
+metrics.histogram('app_phase_duration_seconds', 'Time spent in each phase of building a response.', LATENCY_BUCKETS)
+
+
+@contextmanager
+def span(phase):
+    """
+    Times a phase of a request, e.g. the service lookup or the folium rendering. The time is recorded in
+    app_phase_duration_seconds and, within a request, returned to the browser in the Server-Timing header.
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        metrics.observe('app_phase_duration_seconds', elapsed, {'phase': phase})
+        if has_request_context():
+            g.setdefault('spans', []).append((phase, elapsed))
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of the threads that are serving a request every interval seconds, and counts
+    them in the collapsed format read by flame graph tools (frames separated by ';', then the sample count).
+    """
+
+    def __init__(self, interval=PROFILER_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.samples = Counter()
+        self.active_threads = set()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id in list(self.active_threads):
+                frame = frames.get(thread_id)
+                names = []
+                while frame is not None:
+                    names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                if names:
+                    stacks.append(';'.join(reversed(names)))
+            with self.lock:
+                self.samples.update(stacks)
+
+    def collapsed(self, reset=False):
+        with self.lock:
+            samples = self.samples.most_common()
+            if reset:
+                self.samples.clear()
+        return ''.join(f'{stack} {count}\n' for stack, count in samples)
+
+
+def _cache_collector(caches):
+    # Hits and misses of functools.lru_cache functions. Clearing a cache resets them, which Prometheus treats as a counter reset.
+    def collect():
+        infos = {name: cached.cache_info() for name, cached in caches.items()}
+        return [
+            ('app_cache_hits_total', 'counter', 'Lookups answered from a response cache.',
+             [({'cache': name}, info.hits) for name, info in infos.items()]),
+            ('app_cache_misses_total', 'counter', 'Lookups that had to build the response.',
+             [({'cache': name}, info.misses) for name, info in infos.items()]),
+            ('app_cache_entries', 'gauge', 'Responses currently held in a response cache.',
+             [({'cache': name}, info.currsize) for name, info in infos.items()]),
+        ]
+    return collect
+
+
+def init_metrics(app, caches=None):
+    """
+    Instruments a Flask app: times every request, records response sizes, serves the metrics at METRICS_URL
+    and, when SAMPLING_PROFILER is set, starts the sampling profiler and serves its samples at PROFILE_URL.
+
+    Parameters:
+    - app: Flask, the app to instrument.
+    - caches: dict, optional, maps a name to a functools.lru_cache function whose hits and misses are reported.
+    """
+    if caches:
+        metrics.add_collector('caches', _cache_collector(caches))
+
+    profiler = None
+    if SAMPLING_PROFILER:
+        profiler = SamplingProfiler()
+        profiler.start()
+        print(f"Sampling profiler started, every {PROFILER_INTERVAL * 1000:g} ms. Samples are served at {PROFILE_URL}.")
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started_at = time.perf_counter()
+        if profiler is not None:
+            profiler.active_threads.add(threading.get_ident())
+
+    @app.teardown_request
+    def stop_profiling_request(error=None):
+        if profiler is not None:
+            profiler.active_threads.discard(threading.get_ident())
+
+    @app.after_request
+    def record_request(response):
+        if 'request_started_at' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_started_at
+        endpoint = request.endpoint or 'unmatched'
+        metrics.inc('app_requests_total', {'endpoint': endpoint, 'method': request.method, 'status': response.status_code})
+        metrics.observe('app_request_duration_seconds', elapsed, {'endpoint': endpoint})
+        if not response.direct_passthrough:
+            metrics.observe('app_response_size_bytes', response.calculate_content_length() or 0, {'endpoint': endpoint})
+
+        spans = g.get('spans', [])
+        response.headers['Server-Timing'] = ', '.join(
+            [f'{phase};dur={duration * 1000:.2f}' for phase, duration in spans] + [f'total;dur={elapsed * 1000:.2f}']
+        )
+        return response
+
+    @app.route(METRICS_URL, methods=['GET'])
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    if profiler is not None:
+        @app.route(PROFILE_URL, methods=['GET'])
+        def sampling_profile():
+            # ?reset=1 starts a new profile after returning this one
+            return Response(profiler.collapsed(reset=request.args.get('reset') == '1'), mimetype='text/plain')
@@ -0,0 +1,493 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import polyline
+from shapely.geometry import LineString, MultiLineString
+from shapely.ops import linemerge
+
+from projection import SVY21, WGS84, buffer_bus_route, to_svy21
+
+# Results of an earlier run, which later runs are compared against
+benchmark_baseline_path = 'benchmarks/baseline.json'
+
+# A stage regresses when its median latency or peak memory grows by more than this share of the baseline
+REGRESSION_TOLERANCE = 0.25
+
+# Peak memory below this many MB is too small to compare reliably
+MIN_COMPARED_PEAK_MB = 1.0
+
+# Rough bounds of Singapore, in longitude / latitude, where the synthetic bus stops are placed
+NETWORK_BOUNDS = (103.62, 1.24, 104.0, 1.46)
+
+MRT_LINES = ['NS', 'EW', 'DT', 'CC', 'NE', 'TE']
+
+
+def make_bus_network(services=300, stops_per_service=40, stop_pool=5000, od_rows=500_000, seed=0):
+    """
+    Generates a synthetic bus network shaped like the DataMall and OneMap inputs.
+
+    Each service is a random walk through a pool of bus stops, in both directions. Consecutive stops are
+    joined by a short wiggly road path, stored as an encoded polyline like encoded_polylines_output.csv.
+
+    Parameters:
+    - services: int, number of bus services.
+    - stops_per_service: int, number of stops per service and direction.
+    - stop_pool: int, number of distinct bus stops.
+    - od_rows: int, number of rows of Origin-Destination data.
+    - seed: int, the random seed, so every run benchmarks the same network.
+
+    Returns:
+    - A dict with bus_routes_df, bus_stops_df, encoded_polylines_df, routes_gdf (SVY21), mrt_geoms (SVY21)
+      and od_volume_df.
+    """
+    rng = np.random.default_rng(seed)
+    min_lon, min_lat, max_lon, max_lat = NETWORK_BOUNDS
+    stop_codes = np.sort(rng.choice(np.arange(10000, 99999), size=stop_pool, replace=False))
+    stop_lonlat = np.column_stack([rng.uniform(min_lon, max_lon, stop_pool), rng.uniform(min_lat, max_lat, stop_pool)])
+    bus_stops_df = pd.DataFrame({
+        'BusStopCode': stop_codes.astype(str),
+        'Longitude': stop_lonlat[:, 0],
+        'Latitude': stop_lonlat[:, 1],
+    })
+
+    route_rows = []
+    polyline_rows = []
+    route_lines = []
+    # Like the real network, some services are express variants with a letter suffix, e.g. 10e
+    service_numbers = [f'{number}e' if number % 10 == 0 else str(number) for number in range(1, services + 1)]
+    for service_no in service_numbers:
+        # Walk across the island and snap every step to the nearest stop not yet used by the service
+        position = stop_lonlat[rng.integers(stop_pool)]
+        heading = rng.uniform(0, 2 * np.pi)
+        stops = []
+        while len(stops) < stops_per_service:
+            heading += rng.normal(0, 0.4)
+            position = np.clip(position + 0.004 * np.array([np.cos(heading), np.sin(heading)]), NETWORK_BOUNDS[:2], NETWORK_BOUNDS[2:])
+            distances = np.hypot(*(stop_lonlat - position).T)
+            distances[stops] = np.inf
+            stops.append(int(np.argmin(distances)))
+
+        service_paths = []
+        for direction, direction_stops in [(1, stops), (2, stops[::-1])]:
+            distance = 0.0
+            for sequence, stop in enumerate(direction_stops, start=1):
+                if sequence > 1:
+                    previous = direction_stops[sequence - 2]
+                    # Like routed road segments, each one has its own number of points
+                    points = int(rng.integers(3, 25))
+                    path = np.linspace(stop_lonlat[previous], stop_lonlat[stop], points)
+                    path[1:-1] += rng.normal(0, 0.0003, (points - 2, 2))
+                    distance += float(np.hypot(*(stop_lonlat[stop] - stop_lonlat[previous])) * 111)
+                    polyline_rows.append((service_no, direction, polyline.encode([(lat, lon) for lon, lat in path])))
+                    service_paths.append(path)
+                route_rows.append((service_no, direction, sequence, stop_codes[stop].astype(str), round(distance, 1)))
+        route_lines.append(linemerge(MultiLineString(service_paths)))
+
+    bus_routes_df = pd.DataFrame(route_rows, columns=['ServiceNo', 'Direction', 'StopSequence', 'BusStopCode', 'Distance'])
+    encoded_polylines_df = pd.DataFrame(polyline_rows, columns=['ServiceNo', 'Direction', 'EncodedPolyline'])
+    routes_gdf = to_svy21(gpd.GeoDataFrame({'ServiceNo': service_numbers}, geometry=route_lines, crs=WGS84))
+
+    # Each MRT line crosses the island through a handful of random stations
+    mrt_lines = [
+        LineString(np.column_stack([np.sort(rng.uniform(min_lon, max_lon, 12)), rng.uniform(min_lat, max_lat, 12)]))
+        for _ in MRT_LINES
+    ]
+    mrt_geoms = gpd.GeoSeries(mrt_lines, index=[f'{line}_MRT_geom' for line in MRT_LINES], crs=WGS84).to_crs(SVY21).buffer(400)
+
+    # OD rows between the stops of the network, a quarter of them between consecutive stops of a route
+    segment_origin = bus_routes_df['BusStopCode'].astype(int).to_numpy()
+    consecutive = rng.integers(0, len(segment_origin) - 1, od_rows // 4)
+    origin_codes = np.concatenate([segment_origin[consecutive], rng.choice(stop_codes, od_rows - len(consecutive))])
+    destination_codes = np.concatenate([segment_origin[consecutive + 1], rng.choice(stop_codes, od_rows - len(consecutive))])
+    od_volume_df = pd.DataFrame({
+        'DAY_TYPE': pd.Categorical(rng.choice(['WEEKDAY', 'WEEKENDS/HOLIDAY'], od_rows)),
+        'ORIGIN_PT_CODE': origin_codes.astype('int32'),
+        'DESTINATION_PT_CODE': destination_codes.astype('int32'),
+        'TOTAL_TRIPS': rng.integers(1, 200, od_rows).astype('int32'),
+    })
+
+    return {
+        'bus_routes_df': bus_routes_df,
+        'bus_stops_df': bus_stops_df,
+        'encoded_polylines_df': encoded_polylines_df,
+        'routes_gdf': routes_gdf,
+        'mrt_geoms': mrt_geoms,
+        'od_volume_df': od_volume_df,
+    }
+
+
+class _DataMallReplayHandler(BaseHTTPRequestHandler):
+    # Serves the recorded records one DataMall page at a time, by $skip
+    def do_GET(self):
+        skip = int(parse_qs(urlparse(self.path).query).get('$skip', ['0'])[0])
+        records = self.server.records[skip:skip + self.server.page_size]
+        body = json.dumps({'odata.metadata': '', 'value': records}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_datamall_replay(records, page_size):
+    """
+    Serves records on localhost the way a paginated DataMall API does, so fetch_paginated_data can be
+    benchmarked offline, HTTP and JSON decoding included.
+
+    Returns:
+    - The server (call shutdown() when done) and the URL to fetch.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _DataMallReplayHandler)
+    server.daemon_threads = True
+    server.records = records
+    server.page_size = page_size
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/ltaodataservice/BusRoutes'
+
+
+def record_datamall_dataset(url, path):
+    """
+    Fetches a paginated DataMall dataset once and saves its records, so later benchmark runs can replay
+    them with --recording instead of synthetic records. Needs the API key in .env.
+    """
+    import data_pulling
+
+    records = data_pulling.fetch_paginated_data(url, data_pulling.headers)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(records, f)
+    print(f"Recorded {len(records)} records from {url} to {path}.")
+
+
+def measure(run, repeat, items, setup=None):
+    """
+    Times a stage and measures its peak memory.
+
+    Parameters:
+    - run: callable, one iteration of the stage.
+    - repeat: int, number of timed iterations, after one untimed warm-up.
+    - items: int, how many items (records, services, requests...) one iteration processes.
+    - setup: callable, optional, called untimed before every iteration.
+
+    Returns:
+    - A dict with the latency percentiles in milliseconds, the throughput in items per second at the
+      median latency, and the peak Python heap in MB (measured on a separate, traced iteration).
+    """
+    if setup:
+        setup()
+    run()
+
+    latencies = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+
+    # tracemalloc slows allocations down, so memory is measured apart from the timings
+    if setup:
+        setup()
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies_ms = np.array(latencies) * 1000
+    p50 = float(np.percentile(latencies_ms, 50))
+    return {
+        'iterations': repeat,
+        'items': items,
+        'p50_ms': p50,
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'throughput': items / (p50 / 1000) if p50 > 0 else float('inf'),
+        'peak_mb': peak / 1024 / 1024,
+    }
+
+
+def bench_fetch_paginated_data(network, args):
+    import data_pulling
+
+    if args.recording:
+        with open(args.recording) as f:
+            records = json.load(f)
+    else:
+        records = network['bus_routes_df'].to_dict('records')
+    server, url = start_datamall_replay(records, data_pulling.PAGE_SIZE)
+    try:
+        return measure(lambda: data_pulling.fetch_paginated_data(url, {}), args.repeat, len(records))
+    finally:
+        server.shutdown()
+
+
+def bench_polyline_linemerge(network, args):
+    # The geometry build of data_processing.ipynb from encoded polylines: decode every segment, then merge per service
+    encoded_polylines_df = network['encoded_polylines_df']
+
+    def run():
+        geometries = [LineString([(lon, lat) for lat, lon in polyline.decode(encoded)]) for encoded in encoded_polylines_df['EncodedPolyline']]
+        grouped = pd.Series(geometries, index=encoded_polylines_df['ServiceNo']).groupby(level=0).apply(list)
+        return grouped.apply(lambda lines: linemerge(MultiLineString(lines)))
+
+    return measure(run, args.repeat, encoded_polylines_df['ServiceNo'].nunique())
+
+
+def bench_assemble_service_geometries(network, args):
+    from segment_store import assemble_service_geometries
+
+    encoded_polylines_df = network['encoded_polylines_df']
+    service_segments_df = pd.DataFrame({
+        'ServiceNo': encoded_polylines_df['ServiceNo'],
+        'Direction': encoded_polylines_df['Direction'],
+        'SegmentSequence': encoded_polylines_df.groupby(['ServiceNo', 'Direction']).cumcount() + 1,
+        'segment_id': [f'segment{i}' for i in range(len(encoded_polylines_df))],
+    })
+    store = {
+        key: np.array([(lon, lat) for lat, lon in polyline.decode(encoded)])
+        for key, encoded in zip(service_segments_df['segment_id'], encoded_polylines_df['EncodedPolyline'])
+    }
+    return measure(lambda: assemble_service_geometries(service_segments_df, store), args.repeat, service_segments_df['ServiceNo'].nunique())
+
+
+def _buffered_routes(network):
+    if 'buffered_gdf' not in network:
+        buffered_gdf = buffer_bus_route(network['routes_gdf'], 400)
+        for column, geom in network['mrt_geoms'].items():
+            buffered_gdf[column] = geom
+        network['buffered_gdf'] = buffered_gdf
+    return network['buffered_gdf']
+
+
+def bench_bus_mrt_overlap(network, args):
+    from overlap import bus_mrt_overlap
+
+    buffered_gdf = _buffered_routes(network)
+    return measure(lambda: bus_mrt_overlap(buffered_gdf, network['mrt_geoms']), args.repeat, len(buffered_gdf))
+
+
+def bench_find_bus_alternatives(network, args):
+    from overlap import find_bus_alternatives
+
+    buffered_gdf = _buffered_routes(network)
+    return measure(lambda: find_bus_alternatives(buffered_gdf, k=3, workers=args.workers), args.repeat, len(buffered_gdf))
+
+
+def bench_calculate_total_trips(network, args):
+    from od_volume import aggregate_od_volume_df, calculate_total_trips
+
+    bus_routes_df = network['bus_routes_df'].assign(BusStopCode=network['bus_routes_df']['BusStopCode'].astype('int32'))
+    od_volume_df = network['od_volume_df']
+    return measure(
+        lambda: calculate_total_trips(bus_routes_df, aggregate_od_volume_df(od_volume_df)),
+        args.repeat, len(od_volume_df)
+    )
+
+
+def write_app_fixtures(network, folder):
+    """
+    Writes the inputs app.py loads (see app_bundle.source_paths) for the synthetic network into folder/data.
+    """
+    from overlap import bus_mrt_overlap, find_bus_alternatives
+
+    os.makedirs(os.path.join(folder, 'data'), exist_ok=True)
+    buffered_gdf = _buffered_routes(network)
+    buffered_gdf.to_pickle(os.path.join(folder, 'data', 'buffered_bus_mrt_combined_gdf.pkl'))
+    find_bus_alternatives(buffered_gdf, k=3, workers=1).to_csv(os.path.join(folder, 'data', 'all_bus_overlaps.csv'), index=False)
+    model_df = bus_mrt_overlap(buffered_gdf, network['mrt_geoms']).reset_index()
+    model_df['Category'] = np.where(np.arange(len(model_df)) % 3 == 0, 'FEEDER', 'TRUNK')
+    model_df.to_csv(os.path.join(folder, 'data', 'model_df.csv'), index=False)
+
+
+def _load_app():
+    # app.py loads its data from the working directory when it is imported
+    if 'app' in sys.modules:
+        return importlib.reload(sys.modules['app'])
+    return importlib.import_module('app')
+
+
+def bench_get_bus_route(network, args):
+    # Every request is for a service whose response is not cached, as on the first visit after a deploy
+    app_module = network['app_module']
+    client = app_module.app.test_client()
+    service_numbers = list(network['routes_gdf']['ServiceNo'])
+    requests_made = iter(range(10 ** 9))
+
+    def run():
+        service_no = service_numbers[next(requests_made) % len(service_numbers)]
+        response = client.post('/get_bus_route', json={'service_no': service_no})
+        assert response.status_code == 200, response.status_code
+
+    return measure(run, args.requests, 1, setup=app_module.build_bus_route_response.cache_clear)
+
+
+def bench_api_bus_route(network, args):
+    # The route explorer's JSON endpoint, with warm caches
+    app_module = network['app_module']
+    client = app_module.app.test_client()
+    service_numbers = list(network['routes_gdf']['ServiceNo'])
+    requests_made = iter(range(10 ** 9))
+
+    def run():
+        service_no = service_numbers[next(requests_made) % len(service_numbers)]
+        response = client.get(f'/api/bus_route/{service_no}?zoom=13')
+        assert response.status_code == 200, response.status_code
+
+    return measure(run, args.requests, 1)
+
+
+# Stages in the order they run in the pipeline: ingestion, geometry build, features, serving
+STAGES = {
+    'fetch_paginated_data': bench_fetch_paginated_data,
+    'polyline_linemerge': bench_polyline_linemerge,
+    'assemble_service_geometries': bench_assemble_service_geometries,
+    'bus_mrt_overlap': bench_bus_mrt_overlap,
+    'find_bus_alternatives': bench_find_bus_alternatives,
+    'calculate_total_trips': bench_calculate_total_trips,
+    'get_bus_route': bench_get_bus_route,
+    'api_bus_route': bench_api_bus_route,
+}
+
+SERVING_STAGES = {'get_bus_route', 'api_bus_route'}
+
+
+def run_benchmarks(args):
+    """
+    Generates the synthetic network and runs the selected stages on it.
+
+    Returns:
+    - A dict with the run's config and the results of every stage (see measure).
+    """
+    config = {
+        'services': args.services,
+        'stops_per_service': args.stops,
+        'od_rows': args.od_rows,
+        'seed': args.seed,
+        'recording': args.recording,
+    }
+    print(f"Generating a network of {args.services} services with {args.stops} stops each...")
+    network = make_bus_network(args.services, args.stops, od_rows=args.od_rows, seed=args.seed)
+
+    results = {}
+    previous_folder = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        # The app reads data/ relative to the working directory, on import and on every request
+        os.chdir(folder)
+        try:
+            if SERVING_STAGES & set(args.stages):
+                write_app_fixtures(network, folder)
+                network['app_module'] = _load_app()
+            for name in args.stages:
+                print(f"Running {name}...")
+                results[name] = STAGES[name](network, args)
+        finally:
+            os.chdir(previous_folder)
+
+    return {
+        'config': config,
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'stages': results,
+    }
+
+
+def print_report(report):
+    print(f"{'stage':<30}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'items/s':>12}{'peak MB':>10}")
+    for name, result in report['stages'].items():
+        print(f"{name:<30}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+              f"{result['throughput']:>12.1f}{result['peak_mb']:>10.1f}")
+
+
+def compare_to_baseline(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Lists the stages that got slower or use more memory than in the baseline.
+
+    Returns:
+    - A list of messages, empty when nothing regressed. Stages missing from either run are skipped, and
+      nothing is compared when the runs used different network sizes.
+    """
+    if baseline['config'] != report['config']:
+        print(f"The baseline was recorded with {baseline['config']}, not {report['config']}; not comparing.")
+        return []
+
+    regressions = []
+    for name, result in report['stages'].items():
+        if name not in baseline['stages']:
+            continue
+        for metric in ['p50_ms', 'peak_mb']:
+            before, after = baseline['stages'][name][metric], result[metric]
+            if metric == 'peak_mb' and after < MIN_COMPARED_PEAK_MB:
+                continue
+            if before > 0 and after > before * (1 + tolerance):
+                regressions.append(f"{name}: {metric} went from {before:.2f} to {after:.2f} (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def load_baseline(path=benchmark_baseline_path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+
+def save_baseline(report, path=benchmark_baseline_path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+    print(f"Baseline saved to {path}.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion, geometry and serving hot paths offline, on a synthetic bus network.")
+    parser.add_argument('stages', nargs='*', help=f"Stages to run (default: all): {', '.join(STAGES)}.")
+    parser.add_argument('--services', type=int, default=300, help="Number of bus services in the synthetic network.")
+    parser.add_argument('--stops', type=int, default=40, help="Number of stops per service and direction.")
+    parser.add_argument('--od-rows', type=int, default=500_000, help="Number of Origin-Destination rows.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help="Timed iterations of each batch stage.")
+    parser.add_argument('--requests', type=int, default=100, help="Timed requests of each serving stage.")
+    parser.add_argument('--workers', type=int, default=1, help="Processes used by find_bus_alternatives.")
+    parser.add_argument('--recording', help="JSON list of DataMall records (see record_datamall_dataset) to replay instead of synthetic ones.")
+    parser.add_argument('--baseline', default=benchmark_baseline_path, help="Baseline file to compare against.")
+    parser.add_argument('--save-baseline', action='store_true', help="Save this run as the new baseline.")
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE, help="Allowed slowdown before a stage is flagged.")
+    parser.add_argument('--output', help="Also write the results as JSON to this file.")
+    args = parser.parse_args()
+    unknown = [name for name in args.stages if name not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+    args.stages = args.stages or list(STAGES)
+
+    report = run_benchmarks(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        save_baseline(report, args.baseline)
+    else:
+        baseline = load_baseline(args.baseline)
+        regressions = compare_to_baseline(report, baseline, args.tolerance) if baseline else []
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
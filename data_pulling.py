@@ -1,6 +1,21 @@
+import argparse
+import asyncio
+import hashlib
+import json
 import os
+import random
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+import aiohttp
 import requests
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from bs4 import BeautifulSoup
 
@@ -15,31 +30,274 @@ ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
 # Define the headers, including the API key from the environment variable
 headers = {"AccountKey": api_key, "accept": "application/json"}
 
-# Set the data folder for saving files
+# Set the data folder for saving files. It is created when a fetch starts, not on import.
 data_folder = "data"
 
-# Ensure the data folder exists
-os.makedirs(data_folder, exist_ok=True)
+# DataMall returns at most 500 records per call and is paged with $skip
+PAGE_SIZE = 500
+
+# Number of $skip pages requested at the same time by fetch_paginated_data
+PAGE_PREFETCH = 4
+
+# Number of datasets fetched at the same time by fetch_all_data
+MAX_WORKERS = 6
+
+# Maximum requests per second sent to each host. OneMap allows 250 calls a
+# minute; DataMall does not publish a hard limit, so we stay well below the
+# rate at which it starts answering with 429.
+HOST_RATE_LIMITS = {
+    "datamall2.mytransport.sg": 10,
+    "www.onemap.gov.sg": 4,
+}
+
+# Responses that mean "slow down" or "try again later" rather than "this request is wrong"
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Number of times a throttled or failed API call is retried before giving up
+HTTP_RETRIES = 5
+
+# Retries wait a random time of up to BACKOFF_BASE * 2 ** attempt seconds, capped at BACKOFF_MAX
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+# Requests in flight at the same time in the async fetch mode
+ASYNC_CONCURRENCY = 16
+
+# Set FETCH_MODE=async to fetch with asyncio instead of threads
+FETCH_MODE = os.getenv("FETCH_MODE", "sync")
+
+
+class FetchError(Exception):
+    """Raised when a dataset cannot be fetched completely."""
+
+
+class RateLimiter:
+    """
+    Spaces out calls so that no more than `rate` calls per second are made.
+
+    Parameters:
+    - rate: float, the maximum number of calls per second.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        # Reserve the next free slot, then sleep outside the lock until it arrives
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_time)
+            self.next_time = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+rate_limiters = {host: RateLimiter(rate) for host, rate in HOST_RATE_LIMITS.items()}
+
+
+# Shared session so that every fetcher reuses pooled keep-alive connections
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=len(HOST_RATE_LIMITS) + 2, pool_maxsize=MAX_WORKERS * PAGE_PREFETCH)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+
+
+# Exponential backoff with full jitter, so throttled clients do not all retry at the same moment.
+# A Retry-After header from the server takes precedence.
+def backoff_delay(attempt, retry_after=None):
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+# Helper function to send a GET request through the shared session and the host's rate limit.
+# Throttled (429) and server error (5xx) responses are retried with backoff; the last response
+# is returned if every attempt fails.
+def http_get(url, **kwargs):
+    limiter = rate_limiters.get(urlparse(url).hostname)
+    for attempt in range(HTTP_RETRIES + 1):
+        if limiter is not None:
+            limiter.wait()
+        response = session.get(url, **kwargs)
+        if response.status_code not in RETRY_STATUS_CODES or attempt == HTTP_RETRIES:
+            return response
+        delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+        print(f"{url} answered {response.status_code}, retrying in {delay:.1f}s ({attempt + 1}/{HTTP_RETRIES}).")
+        response.close()
+        time.sleep(delay)
+
+
+# Manifest of every artifact written to the data folder. Each entry records
+# where the file came from and what it looked like, so that later runs can
+# skip or conditionally request inputs that have not changed upstream.
+manifest_path = os.path.join(data_folder, "manifest.json")
+manifest_lock = threading.Lock()
+
+
+def load_manifest():
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {}
+
+
+def record_artifact(file_name, source_url, content_hash, size, etag=None, last_modified=None):
+    # Fetchers run in parallel, so read-modify-write the manifest under a lock
+    with manifest_lock:
+        manifest = load_manifest()
+        manifest[file_name] = {
+            "source_url": source_url,
+            "size": size,
+            "etag": etag,
+            "last_modified": last_modified,
+            "sha256": content_hash,
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
+
+
+# Returns the manifest entry for a file only if the file on disk still matches it
+def get_unchanged_artifact(file_name):
+    entry = load_manifest().get(file_name)
+    path = os.path.join(data_folder, file_name)
+    if entry is None or not os.path.exists(path):
+        return None
+    if os.path.getsize(path) != entry["size"]:
+        return None
+    return entry
+
+
+# Builds If-None-Match / If-Modified-Since headers for a previously downloaded file
+def conditional_headers(file_name):
+    entry = get_unchanged_artifact(file_name)
+    if entry is None:
+        return {}
+    request_headers = {}
+    if entry.get("etag"):
+        request_headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        request_headers["If-Modified-Since"] = entry["last_modified"]
+    return request_headers
+
+
+# Explicit column types for the pulled tables. Bus stop codes are stored as
+# integers, which is also how the OD archives encode ORIGIN/DESTINATION_PT_CODE.
+DATASET_DTYPES = {
+    "bus_routes_data": {
+        "ServiceNo": "string",
+        "Operator": "category",
+        "Direction": "int8",
+        "StopSequence": "int16",
+        "BusStopCode": "int32",
+        "Distance": "float32",
+    },
+    "bus_stops_data": {
+        "BusStopCode": "int32",
+        "RoadName": "string",
+        "Description": "string",
+        "Latitude": "float64",
+        "Longitude": "float64",
+    },
+    "BusServicesInfo": {
+        "ServiceNo": "string",
+        "Operator": "category",
+        "Direction": "int8",
+        "Category": "category",
+        "OriginCode": "Int32",
+        "DestinationCode": "Int32",
+    },
+}
+
+# Column types for the Origin-Destination bus archives
+OD_DTYPES = {
+    "YEAR_MONTH": "string",
+    "DAY_TYPE": "category",
+    "TIME_PER_HOUR": "int8",
+    "PT_TYPE": "category",
+    "ORIGIN_PT_CODE": "int32",
+    "DESTINATION_PT_CODE": "int32",
+    "TOTAL_TRIPS": "int32",
+}
+
+# OD data is written as one Parquet partition per month, e.g. od_bus/YEAR_MONTH=202408/
+od_parquet_folder = os.path.join(data_folder, "od_bus")
+
+# Rows converted at a time when turning an OD archive into Parquet
+OD_CHUNK_SIZE = 1_000_000
+
+
+# Helper function to cast a DataFrame to the column types declared for its dataset
+def apply_dtypes(df, dataset_name):
+    df = df.copy()
+    # Parquet needs string column names (the population sheet uses years such as 2024)
+    df.columns = [str(col) for col in df.columns]
+    dtypes = DATASET_DTYPES.get(dataset_name, {})
+    for col in df.columns:
+        if col in dtypes:
+            dtype = dtypes[col]
+            if dtype.lower().startswith(("int", "float")):
+                df[col] = pd.to_numeric(df[col])
+            df[col] = df[col].astype(dtype)
+        elif col.isdigit():
+            # Yearly population counts use "-" for zero
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+        elif df[col].dtype == object:
+            df[col] = df[col].astype("string")
+    return df
+
+
+# Helper function to save a DataFrame as Parquet, skipping the write when the content is unchanged
+def save_dataframe(df, dataset_name, source_url):
+    file_name = dataset_name + ".parquet"
+    path = os.path.join(data_folder, file_name)
+    content = apply_dtypes(df, dataset_name).to_parquet(index=False, engine="pyarrow")
+    content_hash = hashlib.sha256(content).hexdigest()
+    entry = get_unchanged_artifact(file_name)
+    if entry is not None and entry["sha256"] == content_hash:
+        print(f"{path} is unchanged, skipping write.")
+        return path
+    with open(path, "wb") as f:
+        f.write(content)
+    record_artifact(file_name, source_url, content_hash, len(content))
+    return path
 
 
 # Helper function to fetch paginated data
 def fetch_paginated_data(url, headers):
     all_data = []
     skip = 0
-    while True:
-        response = requests.get(url, headers=headers, params={"$skip": skip})
-        if response.status_code == 200:
-            data = response.json()
-            if not data["value"]:
-                break
-            all_data.extend(data["value"])
-            skip += 500
-        else:
-            print(
-                f"Failed to retrieve data from {url}. Status code: {response.status_code}"
-            )
-            break
-    return all_data
+
+    def fetch_page(page_skip):
+        return http_get(url, headers=headers, params={"$skip": page_skip})
+
+    # Request PAGE_PREFETCH pages at a time and keep them in $skip order
+    with ThreadPoolExecutor(max_workers=PAGE_PREFETCH) as executor:
+        while True:
+            skips = [skip + i * PAGE_SIZE for i in range(PAGE_PREFETCH)]
+            responses = list(executor.map(fetch_page, skips))
+            for page_skip, response in zip(skips, responses):
+                if response.status_code != 200:
+                    # Stopping here would silently save a truncated dataset
+                    raise FetchError(
+                        f"Failed to retrieve data from {url} at $skip={page_skip}. Status code: {response.status_code}"
+                    )
+                data = response.json()
+                if not data["value"]:
+                    return all_data
+                all_data.extend(data["value"])
+                # A short page is the last page, so there is nothing left to prefetch
+                if len(data["value"]) < PAGE_SIZE:
+                    return all_data
+            skip += PAGE_PREFETCH * PAGE_SIZE
 
 
 # 1. Bus Routes API
@@ -49,8 +307,7 @@ def fetch_bus_routes():
     bus_routes_data = fetch_paginated_data(url, headers)
     if bus_routes_data:
         bus_routes_df = pd.DataFrame(bus_routes_data)
-        bus_routes_path = os.path.join(data_folder, "bus_routes_data.csv")
-        bus_routes_df.to_csv(bus_routes_path, index=False)
+        bus_routes_path = save_dataframe(bus_routes_df, "bus_routes_data", url)
         print(f"Bus Routes data saved to {bus_routes_path}.")
     else:
         print("No Bus Routes data retrieved.")
@@ -63,24 +320,123 @@ def fetch_bus_stops():
     bus_stops_data = fetch_paginated_data(url, headers)
     if bus_stops_data:
         bus_stops_df = pd.DataFrame(bus_stops_data)
-        bus_stops_path = os.path.join(data_folder, "bus_stops_data.csv")
-        bus_stops_df.to_csv(bus_stops_path, index=False)
+        bus_stops_path = save_dataframe(bus_stops_df, "bus_stops_data", url)
         print(f"Bus Stops data saved to {bus_stops_path}.")
     else:
         print("No Bus Stops data retrieved.")
 
 
-# Helper function to download and save ZIP file
+# Size of the chunks streamed from a download straight to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Number of times a dropped download is resumed before giving up
+DOWNLOAD_RETRIES = 5
+
+# Seconds to wait for the server to connect / send the next chunk
+DOWNLOAD_TIMEOUT = (10, 60)
+
+
+# Helper function to hash a file without loading it into memory
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Helper functions to keep the validator of a partial download next to it, so a later run
+# only resumes the partial file if the upstream file has not changed since
+def load_part_validator(part_path):
+    validator_path = part_path + ".json"
+    if not os.path.exists(validator_path):
+        return None, None
+    with open(validator_path) as f:
+        validator = json.load(f)
+    return validator.get("etag"), validator.get("last_modified")
+
+
+def save_part_validator(part_path, etag, last_modified):
+    with open(part_path + ".json", "w") as f:
+        json.dump({"etag": etag, "last_modified": last_modified}, f)
+
+
+def discard_partial_download(part_path):
+    for path in (part_path, part_path + ".json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# Helper function to download and save ZIP file. Returns the path of the archive, or raises FetchError if it could not be downloaded.
 def download_zip_file(download_url, file_name):
     print(f"Downloading file from {download_url}...")
-    response = requests.get(download_url)
-    if response.status_code == 200:
-        zip_path = os.path.join(data_folder, file_name)
-        with open(zip_path, "wb") as file:
-            file.write(response.content)
-        print(f"Downloaded and saved {zip_path}.")
+    zip_path = os.path.join(data_folder, file_name)
+    part_path = zip_path + ".part"
+    etag, last_modified = load_part_validator(part_path)
+    if os.path.exists(part_path) and not (etag or last_modified):
+        # Without a validator there is no telling whether the partial file is still the same file
+        print(f"Discarding {part_path}, its upstream version is unknown.")
+        discard_partial_download(part_path)
+
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        # A partial file is only resumed when its validator is known
+        resumable = os.path.exists(part_path) and (etag or last_modified)
+        resume_from = os.path.getsize(part_path) if resumable else 0
+        if resume_from:
+            # Continue a dropped download, but only if the file has not changed since.
+            # If-Range makes the server send the whole new file (200) when it has.
+            request_headers = {"Range": f"bytes={resume_from}-", "If-Range": etag or last_modified}
+        else:
+            # Ask the server to skip the body if our copy is still current
+            request_headers = conditional_headers(file_name)
+
+        try:
+            with http_get(download_url, headers=request_headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                if response.status_code == 304:
+                    print(f"{zip_path} is unchanged upstream, skipping download.")
+                    return zip_path
+                if response.status_code == 416:
+                    # The partial file already holds every byte
+                    break
+                if response.status_code not in (200, 206):
+                    raise FetchError(f"Failed to download {file_name}. Status code: {response.status_code}")
+
+                if response.status_code == 200:
+                    # A full response, either a fresh download or the server refused to resume, so start over
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+                    save_part_validator(part_path, etag, last_modified)
+                mode = "ab" if response.status_code == 206 else "wb"
+                with open(part_path, mode) as file:
+                    file.writelines(response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE))
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            print(f"Download of {file_name} interrupted (attempt {attempt}/{DOWNLOAD_RETRIES}): {e}")
     else:
-        print(f"Failed to download file. Status code: {response.status_code}")
+        raise FetchError(f"Failed to download {file_name} after {DOWNLOAD_RETRIES} attempts. Partial file kept at {part_path}.")
+
+    # Check the archive before it replaces the previous copy
+    try:
+        with zipfile.ZipFile(part_path) as z:
+            bad_member = z.testzip()
+    except zipfile.BadZipFile:
+        bad_member = part_path
+    if bad_member is not None:
+        discard_partial_download(part_path)
+        raise FetchError(f"Downloaded archive {file_name} is corrupt ({bad_member}), discarded it.")
+
+    os.replace(part_path, zip_path)
+    discard_partial_download(part_path)
+    record_artifact(
+        file_name,
+        download_url.split("?")[0],
+        file_sha256(zip_path),
+        os.path.getsize(zip_path),
+        etag=etag,
+        last_modified=last_modified,
+    )
+    print(f"Downloaded and saved {zip_path}.")
+    return zip_path
 
 
 # 3. Passenger Volume by Bus Stops API
@@ -88,36 +444,70 @@ def fetch_passenger_volume_by_bus_stops(date="202408"):
     print("Fetching Passenger Volume by Bus Stops...")
     url = "https://datamall2.mytransport.sg/ltaodataservice/PV/Bus"
     params = {"Date": date}
-    response = requests.get(url, headers=headers, params=params)
+    response = http_get(url, headers=headers, params=params)
     if response.status_code == 200:
         data = response.json()
         if "value" in data and data["value"]:
             download_link = data["value"][0]["Link"]
             download_zip_file(download_link, "transport_node_bus_202408.zip")
         else:
-            print("No Passenger Volume by Bus Stops data available.")
+            raise FetchError("No Passenger Volume by Bus Stops data available.")
     else:
-        print(
+        raise FetchError(
             f"Failed to retrieve Passenger Volume by Bus Stops. Status code: {response.status_code}"
         )
 
 
+# Helper function to convert a monthly OD archive into its Parquet partition.
+# The CSV is read in chunks so the whole month never sits in memory at once.
+def convert_od_zip_to_parquet(date):
+    zip_path = os.path.join(data_folder, "origin_destination_bus_" + date + ".zip")
+    csv_file_name = "origin_destination_bus_" + date + ".csv"
+    partition_folder = os.path.join(od_parquet_folder, "YEAR_MONTH=" + date)
+    parquet_path = os.path.join(partition_folder, "part-0.parquet")
+
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(zip_path):
+        print(f"{parquet_path} is up to date.")
+        return parquet_path
+
+    print(f"Converting {zip_path} to Parquet...")
+    os.makedirs(partition_folder, exist_ok=True)
+    # YEAR_MONTH is carried by the partition folder name
+    schema = pa.schema([
+        ("DAY_TYPE", pa.dictionary(pa.int8(), pa.string())),
+        ("TIME_PER_HOUR", pa.int8()),
+        ("PT_TYPE", pa.dictionary(pa.int8(), pa.string())),
+        ("ORIGIN_PT_CODE", pa.int32()),
+        ("DESTINATION_PT_CODE", pa.int32()),
+        ("TOTAL_TRIPS", pa.int32()),
+    ])
+    tmp_path = parquet_path + ".tmp"
+    with zipfile.ZipFile(zip_path) as z, z.open(csv_file_name) as csv_file, pq.ParquetWriter(tmp_path, schema) as writer:
+        for chunk in pd.read_csv(csv_file, dtype=OD_DTYPES, chunksize=OD_CHUNK_SIZE):
+            chunk = chunk.drop(columns=["YEAR_MONTH"])
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    os.replace(tmp_path, parquet_path)
+    print(f"OD data for {date} saved to {parquet_path}.")
+    return parquet_path
+
+
 # 4. Passenger Volume by Origin Destination Bus Stops API
 def fetch_od_volume_by_bus_stops(date):
     print("Fetching Passenger Volume by Origin Destination Bus Stops...")
     url = "https://datamall2.mytransport.sg/ltaodataservice/PV/ODBus"
     params = {"Date": date}
-    response = requests.get(url, headers=headers, params=params)
+    response = http_get(url, headers=headers, params=params)
     if response.status_code == 200:
         data = response.json()
         if "value" in data and data["value"]:
             filename = "origin_destination_bus_" + date + ".zip"
             download_link = data["value"][0]["Link"]
             download_zip_file(download_link, filename)
+            convert_od_zip_to_parquet(date)
         else:
-            print("No Origin-Destination Bus Stops data available.")
+            raise FetchError("No Origin-Destination Bus Stops data available.")
     else:
-        print(
+        raise FetchError(
             f"Failed to retrieve OD Bus Stops data for {date}. Status code: {response.status_code}"
         )
 
@@ -126,16 +516,16 @@ def fetch_od_volume_by_train_stations(date="202408"):
     print("Fetching Passenger Volume by Origin Destination Train Stations...")
     url = "https://datamall2.mytransport.sg/ltaodataservice/PV/ODTrain"
     params = {"Date": date}
-    response = requests.get(url, headers=headers, params=params)
+    response = http_get(url, headers=headers, params=params)
     if response.status_code == 200:
         data = response.json()
         if "value" in data and data["value"]:
             download_link = data["value"][0]["Link"]
             download_zip_file(download_link, "od_train_volume_202408.zip")
         else:
-            print("No Origin-Destination Train Stations data available.")
+            raise FetchError("No Origin-Destination Train Stations data available.")
     else:
-        print(
+        raise FetchError(
             f"Failed to retrieve OD Train Stations data. Status code: {response.status_code}"
         )
 
@@ -145,7 +535,7 @@ def fetch_train_stn_geospatial_whole_island(date="202408"):
     print("Fetching Train Station - Geospatial Whole Island...")
     url = "https://datamall2.mytransport.sg/ltaodataservice/GeospatialWholeIsland"
     params = {"Date": date, "ID": "TrainStation"}
-    response = requests.get(url, headers=headers, params=params)
+    response = http_get(url, headers=headers, params=params)
     if response.status_code == 200:
         data = response.json()
         if "value" in data and data["value"]:
@@ -154,9 +544,9 @@ def fetch_train_stn_geospatial_whole_island(date="202408"):
                 download_link, "train_station_geospatial_whole_island_202408.zip"
             )
         else:
-            print("No Train Station - Geospatial Whole Island data available.")
+            raise FetchError("No Train Station - Geospatial Whole Island data available.")
     else:
-        print(
+        raise FetchError(
             f"Failed to retrieve Train Station - Geospatial Whole Island data. Status code: {response.status_code}"
         )
 
@@ -166,7 +556,7 @@ def fetch_train_stn_exit_geospatial_whole_island(date="202408"):
     print("Fetching Train Station Exit - Geospatial Whole Island...")
     url = "https://datamall2.mytransport.sg/ltaodataservice/GeospatialWholeIsland"
     params = {"Date": date, "ID": "TrainStationExit"}
-    response = requests.get(url, headers=headers, params=params)
+    response = http_get(url, headers=headers, params=params)
     if response.status_code == 200:
         data = response.json()
         if "value" in data and data["value"]:
@@ -175,9 +565,9 @@ def fetch_train_stn_exit_geospatial_whole_island(date="202408"):
                 download_link, "train_station_exit_geospatial_whole_island_202408.zip"
             )
         else:
-            print("No Train Station Exit - Geospatial Whole Island data available.")
+            raise FetchError("No Train Station Exit - Geospatial Whole Island data available.")
     else:
-        print(
+        raise FetchError(
             f"Failed to retrieve Train Station Exit - Geospatial Whole Island data. Status code: {response.status_code}"
         )
 
@@ -187,7 +577,7 @@ def fetch_bus_stop_geospatial_whole_island(date="202408"):
     print("Fetching Bus Stop Location - Geospatial Whole Island...")
     url = "https://datamall2.mytransport.sg/ltaodataservice/GeospatialWholeIsland"
     params = {"Date": date, "ID": "BusStopLocation"}
-    response = requests.get(url, headers=headers, params=params)
+    response = http_get(url, headers=headers, params=params)
     if response.status_code == 200:
         data = response.json()
         if "value" in data and data["value"]:
@@ -196,9 +586,9 @@ def fetch_bus_stop_geospatial_whole_island(date="202408"):
                 download_link, "bus_stop_location_geospatial_whole_island_202408.zip"
             )
         else:
-            print("No Bus Stop Location - Geospatial Whole Island data available.")
+            raise FetchError("No Bus Stop Location - Geospatial Whole Island data available.")
     else:
-        print(
+        raise FetchError(
             f"Failed to retrieve Bus Stop Location - Geospatial Whole Island data. Status code: {response.status_code}"
         )
 
@@ -269,7 +659,7 @@ def fetch_mrt_line():
     url = "https://en.wikipedia.org/wiki/List_of_Singapore_MRT_stations"
 
     # Send a GET request to fetch the content of the page
-    response = requests.get(url)
+    response = http_get(url)
 
     # Parse the page content using BeautifulSoup
     soup = BeautifulSoup(response.content, "html.parser")
@@ -286,25 +676,28 @@ def fetch_mrt_line():
     # Check if the DataFrame is not empty before saving it
     if not df_with_lines.empty:
         mrt_df = pd.DataFrame(df_with_lines)
-        mrt_df_path = os.path.join(
-            data_folder, "singapore_mrt_stations_with_lines_filtered.csv"
+        mrt_df_path = save_dataframe(
+            mrt_df, "singapore_mrt_stations_with_lines_filtered", url
         )
-        mrt_df.to_csv(mrt_df_path, index=False)
         print(
             f"Filtered table with MRT line indicators has been saved to '{mrt_df_path}'"
         )
+        return mrt_df_path
     else:
         print("No data available after filtering.")
 
 def fetch_bus_services():
     print("Fetching Bus Services...")
-    url = "https://datamall2.mytransport.sg/ltaodataservice/BusServices"
+    source_url = "https://datamall2.mytransport.sg/ltaodataservice/BusServices"
+    url = source_url
     headers = {"AccountKey": api_key, "accept": "application/json"}
     all_buses = []
 
     # Loop to handle paginated data
     while url:
-        response = requests.get(url, headers=headers)
+        response = http_get(url, headers=headers)
+        if response.status_code != 200:
+            raise FetchError(f"Failed to retrieve data from {url}. Status code: {response.status_code}")
         data = response.json()
         
         # Append data to the list
@@ -313,40 +706,38 @@ def fetch_bus_services():
         # Check for next page
         url = data.get('@odata.nextLink', None)
 
-    # Convert list to DataFrame and save to CSV
+    # Convert list to DataFrame and save to Parquet
     if all_buses:
         all_buses_from_lta = pd.DataFrame(all_buses)
-        bus_services_path = os.path.join(data_folder, "BusServicesInfo.csv")
-        all_buses_from_lta.to_csv(bus_services_path, index=False)
+        bus_services_path = save_dataframe(all_buses_from_lta, "BusServicesInfo", source_url)
         print(f"Bus Services data saved to {bus_services_path}.")
     else:
         print("No Bus Services data retrieved.")
 
-# 1. Fetch Planning Area Names Data and Save to CSV
+# 1. Fetch Planning Area Names Data and Save to Parquet
 def fetch_planning_area_names():
     print("Fetching Planning Area Names...")
     url = "https://www.onemap.gov.sg/api/public/popapi/getPlanningareaNames?year=2019"
     headers = {"Authorization": ACCESS_TOKEN}
     
     # Request data from the API
-    response = requests.get(url, headers=headers)
+    response = http_get(url, headers=headers)
     
     # Check if the request was successful
     if response.status_code == 200:
         data = response.json()
         df_planning_area = pd.DataFrame(data)  # Convert data to DataFrame
         
-        # Save to CSV
-        planning_area_path = os.path.join(data_folder, "PlanningAreaNames.csv")
-        df_planning_area.to_csv(planning_area_path, index=False)
+        # Save to Parquet
+        planning_area_path = save_dataframe(df_planning_area, "PlanningAreaNames", url)
         print(f"Planning area names data saved to {planning_area_path}.")
     else:
-        print(f"Failed to retrieve data. Status Code: {response.status_code}")
+        raise FetchError(f"Failed to retrieve planning area names. Status Code: {response.status_code}")
 
 # Define the file path for the Excel file
 file_path = r'data/population_data.xlsx'
 
-# 1. Fetch Population by Planning Area Data and Save to CSV
+# 1. Fetch Population by Planning Area Data and Save to Parquet
 def fetch_population_data():
     print("Fetching population data by planning area...")
     
@@ -355,15 +746,14 @@ def fetch_population_data():
         df_population_planning_area = pd.read_excel(file_path, header=2)
         print("Population data successfully fetched.")
         
-        # Save to CSV
-        data_folder = "data"
-        os.makedirs(data_folder, exist_ok=True)
-        population_data_path = os.path.join(data_folder, "population_planning_area_data.csv")
-        df_population_planning_area.to_csv(population_data_path, index=False)
+        # Save to Parquet
+        population_data_path = save_dataframe(
+            df_population_planning_area, "population_planning_area_data", file_path
+        )
         print(f"Population data saved to {population_data_path}.")
+        return population_data_path
     except FileNotFoundError:
-        print(f"File not found at {file_path}. Please check the path and try again.")
-        return None
+        raise FetchError(f"File not found at {file_path}. Please check the path and try again.") from None
 
 def fetch_planning_area_data():
     print("Fetching planning area GeoJSON data...")
@@ -371,16 +761,15 @@ def fetch_planning_area_data():
     headers = {"Authorization": ACCESS_TOKEN}
 
     # Send request to API
-    response = requests.get(url, headers=headers)
+    response = http_get(url, headers=headers)
     
     if response.status_code == 200:
         print("Planning area data successfully fetched.")
         return response.json()
     else:
-        print(f"Failed to retrieve data. Status Code: {response.status_code}")
-        return None
-    
-# 2. Save Planning Area Data to CSV
+        raise FetchError(f"Failed to retrieve planning area data. Status Code: {response.status_code}")
+
+# 2. Save Planning Area Data to Parquet
 def save_planning_area_data(data):
     planning_area_data = []
 
@@ -390,68 +779,353 @@ def save_planning_area_data(data):
         geojson_data = area['geojson']  # Extract GeoJSON as a string
         planning_area_data.append({'pln_area_n': planning_area_name, 'geojson': geojson_data})
     
-    # Convert list to DataFrame and save to CSV
+    # Convert list to DataFrame and save to Parquet
     planning_area_location = pd.DataFrame(planning_area_data)
-    planning_area_path = os.path.join(data_folder, "planning_area_geojson_data.csv")
-    planning_area_location.to_csv(planning_area_path, index=False)
+    planning_area_path = save_dataframe(
+        planning_area_location,
+        "planning_area_geojson_data",
+        "https://www.onemap.gov.sg/api/public/popapi/getAllPlanningarea?year=2019",
+    )
     print(f"Planning area data saved to {planning_area_path}.")
-
-# Fetch and save the planning area data
-planning_area_data = fetch_planning_area_data()
-if planning_area_data:
-    save_planning_area_data(planning_area_data)
+    return planning_area_path
 
 # 1. Fetch Planning Area Data with GeoJSON
 def fetch_planning_area_geojson():
-    print("Fetching planning area GeoJSON data...")
-    url = "https://www.onemap.gov.sg/api/public/popapi/getAllPlanningarea?year=2019"
-    headers = {"Authorization": ACCESS_TOKEN}
-    
-    # Request data from the API
-    response = requests.get(url, headers=headers)
-    
-    # Check if the request was successful
-    if response.status_code == 200:
-        data = response.json()
-        planning_area_data = []
-
-        # Extract each planning area name and GeoJSON
-        for area in data['SearchResults']:
-            planning_area_name = area['pln_area_n'].lower()  
-            geojson_data = area['geojson']  # Extract GeoJSON as a string
-            
-            # Append to the list
-            planning_area_data.append({
-                'pln_area_n': planning_area_name,
-                'geojson': geojson_data
-            })
-        
-        # Convert list to DataFrame and save to CSV
-        planning_area_location = pd.DataFrame(planning_area_data)
-        planning_area_path = os.path.join(data_folder, "planning_area_geojson_data.csv")
-        planning_area_location.to_csv(planning_area_path, index=False)
-        print(f"Planning area data saved to {planning_area_path}.")
-    else:
-        print(f"Failed to retrieve data. Status Code: {response.status_code}")
-        return None
-    
+    return save_planning_area_data(fetch_planning_area_data())
+
+
+# Every dataset the script can fetch, as a task graph: name -> (function, arguments, dependencies).
+# A task is called with its arguments followed by the results of its dependencies, so an upstream
+# call shared by several tasks (e.g. the OneMap planning areas) is made once per run.
+TASKS = {
+    "bus_routes": (fetch_bus_routes, (), ()),
+    "bus_stops": (fetch_bus_stops, (), ()),
+    "bus_services": (fetch_bus_services, (), ()),
+    "passenger_volume_bus": (fetch_passenger_volume_by_bus_stops, (), ()),
+    "od_bus_202407": (fetch_od_volume_by_bus_stops, ("202407",), ()),
+    "od_bus_202408": (fetch_od_volume_by_bus_stops, ("202408",), ()),
+    "od_bus_202409": (fetch_od_volume_by_bus_stops, ("202409",), ()),
+    "od_train": (fetch_od_volume_by_train_stations, (), ()),
+    "train_stations_geospatial": (fetch_train_stn_geospatial_whole_island, (), ()),
+    "train_station_exits_geospatial": (fetch_train_stn_exit_geospatial_whole_island, (), ()),
+    "bus_stops_geospatial": (fetch_bus_stop_geospatial_whole_island, (), ()),
+    "mrt_lines": (fetch_mrt_line, (), ()),
+    "planning_area_names": (fetch_planning_area_names, (), ()),
+    "population": (fetch_population_data, (), ()),
+    "planning_area_response": (fetch_planning_area_data, (), ()),
+    "planning_area_geojson": (save_planning_area_data, (), ("planning_area_response",)),
+}
+
+
+# Helper function to list the tasks needed for the requested ones, dependencies first
+def resolve_tasks(names):
+    ordered = []
+
+    def visit(name, path):
+        if name not in TASKS:
+            raise ValueError(f"Unknown dataset {name!r}. Available: {', '.join(TASKS)}")
+        if name in path:
+            raise ValueError(f"Circular dependency: {' -> '.join(path + [name])}")
+        if name in ordered:
+            return
+        for dependency in TASKS[name][2]:
+            visit(dependency, path + [name])
+        ordered.append(name)
+
+    for name in names:
+        visit(name, [])
+    return ordered
+
+
+def run_tasks(names, workers=MAX_WORKERS):
+    """
+    Runs the requested tasks and their dependencies, each at most once. Independent tasks run in
+    parallel; a task starts as soon as all its dependencies have finished.
+
+    Parameters:
+    - names: list of str, task names from TASKS.
+    - workers: int, number of tasks run at the same time.
+
+    Returns:
+    - A dict from task name to "done", "failed" or "skipped" (a dependency failed).
+    """
+    os.makedirs(data_folder, exist_ok=True)
+    pending = resolve_tasks(names)
+    results = {}
+    status = {}
+    running = {}
+
+    # Requests to the same host are still throttled by HOST_RATE_LIMITS.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for name in list(pending):
+                dependencies = TASKS[name][2]
+                if any(status.get(dependency) in ("failed", "skipped") for dependency in dependencies):
+                    print(f"Skipping {name}: a dependency failed.")
+                    status[name] = "skipped"
+                    pending.remove(name)
+                elif all(status.get(dependency) == "done" for dependency in dependencies):
+                    function, args, _ = TASKS[name]
+                    dependency_results = [results[dependency] for dependency in dependencies]
+                    running[executor.submit(function, *args, *dependency_results)] = name
+                    pending.remove(name)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    status[name] = "done"
+                except (FetchError, requests.RequestException, OSError, ValueError, KeyError) as e:
+                    print(f"{name} failed: {e}")
+                    status[name] = "failed"
+    return status
+
+
 # Fetch all data
 def fetch_all_data():
-    fetch_bus_routes()
-    fetch_bus_stops()
-    fetch_passenger_volume_by_bus_stops()
-    fetch_od_volume_by_bus_stops("202407")
-    fetch_od_volume_by_bus_stops("202408")
-    fetch_od_volume_by_bus_stops("202409")
-    fetch_od_volume_by_train_stations()
-    fetch_train_stn_geospatial_whole_island()
-    fetch_train_stn_exit_geospatial_whole_island()
-    fetch_bus_stop_geospatial_whole_island()
-    fetch_mrt_line()
-    fetch_bus_services()
-    fetch_planning_area_names()
-    fetch_population_data()
-    fetch_planning_area_geojson()
-
-# Execute the data fetching
-fetch_all_data()
+    return run_tasks(list(TASKS))
+
+# Async fetch mode. The API calls of every dataset are issued from one event loop, with at most
+# ASYNC_CONCURRENCY in flight, and each dataset reports whether it was fetched completely.
+
+# DataMall datasets paged with $skip: dataset name -> URL
+PAGINATED_DATASETS = {
+    "bus_routes_data": "https://datamall2.mytransport.sg/ltaodataservice/BusRoutes",
+    "bus_stops_data": "https://datamall2.mytransport.sg/ltaodataservice/BusStops",
+    "BusServicesInfo": "https://datamall2.mytransport.sg/ltaodataservice/BusServices",
+}
+
+# DataMall datasets published as a ZIP archive behind a download link: file name -> (URL, query parameters)
+LINK_DATASETS = {
+    "transport_node_bus_202408.zip": ("https://datamall2.mytransport.sg/ltaodataservice/PV/Bus", {"Date": "202408"}),
+    "origin_destination_bus_202407.zip": ("https://datamall2.mytransport.sg/ltaodataservice/PV/ODBus", {"Date": "202407"}),
+    "origin_destination_bus_202408.zip": ("https://datamall2.mytransport.sg/ltaodataservice/PV/ODBus", {"Date": "202408"}),
+    "origin_destination_bus_202409.zip": ("https://datamall2.mytransport.sg/ltaodataservice/PV/ODBus", {"Date": "202409"}),
+    "od_train_volume_202408.zip": ("https://datamall2.mytransport.sg/ltaodataservice/PV/ODTrain", {"Date": "202408"}),
+    "train_station_geospatial_whole_island_202408.zip": (
+        "https://datamall2.mytransport.sg/ltaodataservice/GeospatialWholeIsland", {"Date": "202408", "ID": "TrainStation"}
+    ),
+    "train_station_exit_geospatial_whole_island_202408.zip": (
+        "https://datamall2.mytransport.sg/ltaodataservice/GeospatialWholeIsland", {"Date": "202408", "ID": "TrainStationExit"}
+    ),
+    "bus_stop_location_geospatial_whole_island_202408.zip": (
+        "https://datamall2.mytransport.sg/ltaodataservice/GeospatialWholeIsland", {"Date": "202408", "ID": "BusStopLocation"}
+    ),
+}
+
+PLANNING_AREA_NAMES_URL = "https://www.onemap.gov.sg/api/public/popapi/getPlanningareaNames?year=2019"
+PLANNING_AREA_GEOJSON_URL = "https://www.onemap.gov.sg/api/public/popapi/getAllPlanningarea?year=2019"
+
+
+class AsyncRateLimiter:
+    """
+    asyncio counterpart of RateLimiter: spaces out calls so that no more than `rate` calls per second are made.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = 0.0
+
+    async def wait(self):
+        # The event loop runs one coroutine at a time, so reserving a slot needs no lock
+        now = time.monotonic()
+        slot = max(now, self.next_time)
+        self.next_time = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class DatasetReport:
+    """
+    Tracks how much of a dataset was fetched in the async mode.
+    A dataset is complete once every request succeeded and, for paged data, the last page was reached.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.retries = 0
+        self.records = 0
+        self.complete = False
+        self.error = None
+
+    def summary(self):
+        status = "complete" if self.complete else f"INCOMPLETE ({self.error})"
+        return f"{self.name}: {status}, {self.records} records, {self.requests} requests, {self.retries} retries"
+
+
+class AsyncFetcher:
+    """
+    Shares one aiohttp session, the concurrency limit and the per-host rate limits between datasets.
+    """
+
+    def __init__(self, client, concurrency=ASYNC_CONCURRENCY):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate_limiters = {host: AsyncRateLimiter(rate) for host, rate in HOST_RATE_LIMITS.items()}
+
+    async def get_json(self, url, report, headers=None, params=None):
+        # GET a JSON document, retrying throttled and failed calls with backoff
+        limiter = self.rate_limiters.get(urlparse(url).hostname)
+        # Like requests, leave out headers that are not set (e.g. a missing API key)
+        headers = {key: value for key, value in (headers or {}).items() if value is not None}
+        for attempt in range(HTTP_RETRIES + 1):
+            async with self.semaphore:
+                if limiter is not None:
+                    await limiter.wait()
+                report.requests += 1
+                try:
+                    async with self.client.get(url, headers=headers, params=params) as response:
+                        if response.status == 200:
+                            return await response.json(content_type=None)
+                        if response.status not in RETRY_STATUS_CODES:
+                            raise FetchError(f"{url} answered {response.status}")
+                        error = f"{url} answered {response.status}"
+                        delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+                except (aiohttp.ClientError, TimeoutError) as e:
+                    error = f"{url} failed: {e!r}"
+                    delay = backoff_delay(attempt)
+            if attempt == HTTP_RETRIES:
+                break
+            report.retries += 1
+            await asyncio.sleep(delay)
+        raise FetchError(f"{error} after {HTTP_RETRIES} retries")
+
+    async def get_paginated(self, url, report, window=PAGE_PREFETCH * 2):
+        # Fetch $skip pages `window` at a time until a short or empty page marks the end
+        all_data = []
+        skip = 0
+        while True:
+            skips = [skip + i * PAGE_SIZE for i in range(window)]
+            pages = await asyncio.gather(*(
+                self.get_json(url, report, headers=headers, params={"$skip": page_skip}) for page_skip in skips
+            ))
+            for page in pages:
+                all_data.extend(page["value"])
+                if len(page["value"]) < PAGE_SIZE:
+                    return all_data
+            skip += window * PAGE_SIZE
+
+
+async def fetch_paginated_dataset_async(fetcher, dataset_name, url, report):
+    records = await fetcher.get_paginated(url, report)
+    report.records = len(records)
+    path = await asyncio.to_thread(save_dataframe, pd.DataFrame(records), dataset_name, url)
+    print(f"{dataset_name} saved to {path}.")
+
+
+async def fetch_link_dataset_async(fetcher, file_name, url, params, report):
+    data = await fetcher.get_json(url, report, headers=headers, params=params)
+    if not data.get("value"):
+        raise FetchError(f"No download link returned by {url} for {params}")
+    # The archive download streams to disk and resumes itself, so it runs in a worker thread
+    await asyncio.to_thread(download_zip_file, data["value"][0]["Link"], file_name)
+    report.records = 1
+    if file_name.startswith("origin_destination_bus_"):
+        await asyncio.to_thread(convert_od_zip_to_parquet, params["Date"])
+
+
+async def fetch_planning_area_names_async(fetcher, report):
+    names = await fetcher.get_json(PLANNING_AREA_NAMES_URL, report, headers={"Authorization": ACCESS_TOKEN})
+    # OneMap answers errors such as an expired token with a JSON object instead of the list
+    if not isinstance(names, list):
+        raise FetchError(f"{PLANNING_AREA_NAMES_URL} returned no planning area names: {names}")
+    report.records = len(names)
+    await asyncio.to_thread(save_dataframe, pd.DataFrame(names), "PlanningAreaNames", PLANNING_AREA_NAMES_URL)
+
+
+async def fetch_planning_area_geojson_async(fetcher, report):
+    geojson = await fetcher.get_json(PLANNING_AREA_GEOJSON_URL, report, headers={"Authorization": ACCESS_TOKEN})
+    if "SearchResults" not in geojson:
+        raise FetchError(f"{PLANNING_AREA_GEOJSON_URL} returned no planning areas: {geojson}")
+    report.records = len(geojson["SearchResults"])
+    await asyncio.to_thread(save_planning_area_data, geojson)
+
+
+async def fetch_threaded_dataset_async(fetcher_function, report):
+    # The threaded fetchers return the saved path, or None when nothing was saved
+    path = await asyncio.to_thread(fetcher_function)
+    if path is None:
+        raise FetchError(f"{fetcher_function.__name__} did not save any data")
+    report.records = len(pd.read_parquet(path))
+
+
+async def run_report(report, coroutine):
+    # Records the outcome of one dataset instead of letting it cancel the others.
+    # ValueError and KeyError come from malformed responses, e.g. a page that is not JSON or has no "value".
+    try:
+        await coroutine
+        report.complete = True
+    except (FetchError, aiohttp.ClientError, OSError, ValueError, KeyError) as e:
+        report.error = str(e)
+
+
+async def fetch_all_data_async(concurrency=ASYNC_CONCURRENCY):
+    """
+    Fetches every dataset with asyncio, keeping up to `concurrency` API calls in flight.
+
+    Returns:
+    - A dict of DatasetReport by dataset name, saying which datasets were fetched completely.
+    """
+    os.makedirs(data_folder, exist_ok=True)
+    reports = {}
+    tasks = []
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)) as client:
+        fetcher = AsyncFetcher(client, concurrency)
+
+        for dataset_name, url in PAGINATED_DATASETS.items():
+            report = reports[dataset_name] = DatasetReport(dataset_name)
+            tasks.append(run_report(report, fetch_paginated_dataset_async(fetcher, dataset_name, url, report)))
+
+        for file_name, (url, params) in LINK_DATASETS.items():
+            report = reports[file_name] = DatasetReport(file_name)
+            tasks.append(run_report(report, fetch_link_dataset_async(fetcher, file_name, url, params, report)))
+
+        for dataset_name, fetch_dataset in [
+            ("PlanningAreaNames", fetch_planning_area_names_async),
+            ("planning_area_geojson_data", fetch_planning_area_geojson_async),
+        ]:
+            report = reports[dataset_name] = DatasetReport(dataset_name)
+            tasks.append(run_report(report, fetch_dataset(fetcher, report)))
+
+        # Wikipedia and the local population sheet are single requests, left to the threaded fetchers
+        for fetcher_function, dataset_name in [
+            (fetch_mrt_line, "singapore_mrt_stations_with_lines_filtered"),
+            (fetch_population_data, "population_planning_area_data"),
+        ]:
+            report = reports[dataset_name] = DatasetReport(dataset_name)
+            tasks.append(run_report(report, fetch_threaded_dataset_async(fetcher_function, report)))
+
+        await asyncio.gather(*tasks)
+
+    print("Fetch summary:")
+    for report in reports.values():
+        print("  " + report.summary())
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch the datasets used by the project into the data folder.")
+    parser.add_argument("datasets", nargs="*", help="datasets to fetch (default: all of them)")
+    parser.add_argument("--list", action="store_true", help="list the available datasets and exit")
+    parser.add_argument("--async", dest="use_async", action="store_true", default=FETCH_MODE == "async",
+                        help="fetch every dataset with asyncio (also enabled by FETCH_MODE=async)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="number of datasets fetched at the same time")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (function, task_args, dependencies) in TASKS.items():
+            needs = f" (needs {', '.join(dependencies)})" if dependencies else ""
+            print(f"{name}: {function.__name__}{task_args or ''}{needs}")
+    elif args.use_async:
+        if args.datasets:
+            parser.error("--async always fetches every dataset")
+        asyncio.run(fetch_all_data_async())
+    else:
+        status = run_tasks(args.datasets or list(TASKS), workers=args.workers)
+        failed = [name for name, result in status.items() if result != "done"]
+        if failed:
+            raise SystemExit(f"Not fetched: {', '.join(failed)}")
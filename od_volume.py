@@ -0,0 +1,250 @@
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+# DAY_TYPE values in the OD data and the trip columns they are reported in
+DAY_TYPE_COLUMNS = {
+    'WEEKDAY': 'WEEKDAY_TOTAL_TRIPS',
+    'WEEKENDS/HOLIDAY': 'WEEKEND_TOTAL_TRIPS',
+}
+
+OD_KEY = ['ORIGIN_PT_CODE', 'DESTINATION_PT_CODE']
+
+# Where data_pulling.py saves the monthly OD archives and their Parquet partitions
+od_data_folder = 'data'
+od_parquet_folder = os.path.join(od_data_folder, 'od_bus')
+
+# The only OD columns the aggregation reads, with the narrowest types that hold them
+OD_STREAM_DTYPES = {
+    'DAY_TYPE': 'category',
+    'ORIGIN_PT_CODE': 'int32',
+    'DESTINATION_PT_CODE': 'int32',
+    'TOTAL_TRIPS': 'int32',
+}
+
+# Rows read at a time by stream_aggregate_od_volume. Memory use is about this many rows plus the running aggregate.
+OD_STREAM_CHUNK_SIZE = 1_000_000
+
+# Bus stop codes have 5 digits, so 17 bits hold one. DAY_TYPE and both stop codes are packed into one int64 key.
+_STOP_CODE_BITS = 17
+
+
+def aggregate_od_volume_df(od_volume_df):
+    aggregated_df = (
+        od_volume_df
+        .groupby(['DAY_TYPE', 'ORIGIN_PT_CODE', 'DESTINATION_PT_CODE'], as_index=False, observed=True)
+        .agg(AGGREGATED_TOTAL_TRIPS=('TOTAL_TRIPS', 'sum'))
+    )
+
+    return aggregated_df
+
+
+def od_month_source(month, data_folder=od_data_folder):
+    """
+    Finds the OD data of a month, preferring the Parquet partition over the ZIP archive.
+
+    Parameters:
+    - month: str, the month as YYYYMM, e.g. '202408'.
+
+    Returns:
+    - The path of the partition folder or of the ZIP archive.
+    """
+    partition_path = os.path.join(data_folder, 'od_bus', 'YEAR_MONTH=' + month)
+    if os.path.exists(partition_path):
+        return partition_path
+    return os.path.join(data_folder, 'origin_destination_bus_' + month + '.zip')
+
+
+def iter_od_chunks(source, chunk_size=OD_STREAM_CHUNK_SIZE):
+    """
+    Reads OD data in chunks of at most chunk_size rows, with only the columns in OD_STREAM_DTYPES.
+
+    Parameters:
+    - source: str, an origin_destination_bus_YYYYMM.zip archive, or a Parquet file or partition folder.
+    - chunk_size: int, the number of rows per chunk.
+
+    Returns:
+    - An iterator of DataFrames.
+    """
+    columns = list(OD_STREAM_DTYPES)
+    if source.endswith('.zip'):
+        with zipfile.ZipFile(source) as z:
+            csv_file_name = next(name for name in z.namelist() if name.endswith('.csv'))
+            with z.open(csv_file_name) as csv_file:
+                yield from pd.read_csv(csv_file, usecols=columns, dtype=OD_STREAM_DTYPES, chunksize=chunk_size)
+    else:
+        for batch in ds.dataset(source, format='parquet').to_batches(columns=columns, batch_size=chunk_size):
+            yield batch.to_pandas()
+
+
+def _pack_od_key(day_type_codes, origin_codes, destination_codes):
+    return (
+        (day_type_codes.astype(np.int64) << (2 * _STOP_CODE_BITS))
+        | (origin_codes.astype(np.int64) << _STOP_CODE_BITS)
+        | destination_codes.astype(np.int64)
+    )
+
+
+def stream_aggregate_od_volume(sources, chunk_size=OD_STREAM_CHUNK_SIZE, od_pairs=None):
+    """
+    Aggregates one or more months of OD data like aggregate_od_volume_df, without loading any month whole.
+
+    Each chunk is summed per (DAY_TYPE, ORIGIN_PT_CODE, DESTINATION_PT_CODE) and folded into a running
+    total, so memory use is bounded by chunk_size and the number of distinct OD pairs, not the number of months.
+
+    Parameters:
+    - sources: list of str, the OD data to read (see od_month_source). Their trips are summed.
+    - chunk_size: int, the number of rows read at a time.
+    - od_pairs: DataFrame, optional, with ORIGIN_PT_CODE and DESTINATION_PT_CODE. If given, only these OD
+      pairs are kept, e.g. the segments from build_route_segments, which keeps the running total small.
+
+    Returns:
+    - A DataFrame with DAY_TYPE, ORIGIN_PT_CODE, DESTINATION_PT_CODE and AGGREGATED_TOTAL_TRIPS.
+    """
+    day_types = list(DAY_TYPE_COLUMNS)
+    wanted_pairs = None
+    if od_pairs is not None:
+        wanted_pairs = np.unique(_pack_od_key(
+            np.zeros(len(od_pairs), dtype=np.int64),
+            od_pairs['ORIGIN_PT_CODE'].to_numpy(), od_pairs['DESTINATION_PT_CODE'].to_numpy()
+        ))
+
+    totals = pd.Series(dtype='int64')
+    rows = 0
+    for source in sources:
+        for chunk in iter_od_chunks(source, chunk_size):
+            rows += len(chunk)
+            day_type_codes = pd.Categorical(chunk['DAY_TYPE'], categories=day_types).codes
+            if (day_type_codes < 0).any():
+                unknown = set(chunk['DAY_TYPE'][day_type_codes < 0].astype(str))
+                raise ValueError(f"Unknown DAY_TYPE in {source}: {sorted(unknown)}")
+
+            keys = _pack_od_key(day_type_codes, chunk['ORIGIN_PT_CODE'].to_numpy(), chunk['DESTINATION_PT_CODE'].to_numpy())
+            trips = chunk['TOTAL_TRIPS'].to_numpy()
+            if wanted_pairs is not None:
+                keep = np.isin(keys & ((1 << (2 * _STOP_CODE_BITS)) - 1), wanted_pairs)
+                keys, trips = keys[keep], trips[keep]
+
+            chunk_totals = pd.Series(trips, dtype='int64').groupby(keys, sort=False).sum()
+            totals = pd.concat([totals, chunk_totals]).groupby(level=0, sort=False).sum()
+        print(f"Aggregated {rows} OD rows into {len(totals)} OD pairs after {source}.")
+
+    totals = totals.sort_index()
+    keys = totals.index.to_numpy(dtype=np.int64)
+    stop_code_mask = (1 << _STOP_CODE_BITS) - 1
+    return pd.DataFrame({
+        'DAY_TYPE': pd.Categorical.from_codes(keys >> (2 * _STOP_CODE_BITS), categories=day_types),
+        'ORIGIN_PT_CODE': ((keys >> _STOP_CODE_BITS) & stop_code_mask).astype('int32'),
+        'DESTINATION_PT_CODE': (keys & stop_code_mask).astype('int32'),
+        'AGGREGATED_TOTAL_TRIPS': totals.to_numpy(dtype=np.int64),
+    })
+
+
+def build_route_segments(bus_routes_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Lists every pair of consecutive bus stops (a segment) of every bus service and direction.
+
+    Parameters:
+    - bus_routes_df: DataFrame, the BusRoutes data with ServiceNo, Direction, StopSequence and BusStopCode.
+
+    Returns:
+    - A DataFrame with ServiceNo, Direction, ORIGIN_PT_CODE and DESTINATION_PT_CODE, in StopSequence order.
+    """
+    ordered_df = bus_routes_df.sort_values(by=['ServiceNo', 'Direction', 'StopSequence'])
+
+    # The destination of each segment is the next stop of the same service and direction
+    next_stop = ordered_df.groupby(['ServiceNo', 'Direction'], sort=False)['BusStopCode'].shift(-1)
+
+    segments_df = pd.DataFrame({
+        'ServiceNo': ordered_df['ServiceNo'],
+        'Direction': ordered_df['Direction'],
+        'ORIGIN_PT_CODE': ordered_df['BusStopCode'],
+        'DESTINATION_PT_CODE': next_stop,
+    })
+
+    # The last stop of a route does not start a segment
+    segments_df = segments_df.dropna(subset=['DESTINATION_PT_CODE'])
+    segments_df['DESTINATION_PT_CODE'] = segments_df['DESTINATION_PT_CODE'].astype(ordered_df['BusStopCode'].dtype)
+
+    return segments_df.reset_index(drop=True)
+
+
+def _trips_by_od_pair(aggregated_od_volume_df, keys):
+    # Sum the trips per OD pair and spread the day types (and any extra keys) out as columns
+    trips = (
+        aggregated_od_volume_df
+        .groupby(keys + ['DAY_TYPE'] + OD_KEY, observed=True)['AGGREGATED_TOTAL_TRIPS']
+        .sum()
+        .unstack(keys + ['DAY_TYPE'], fill_value=0)
+    )
+    return trips
+
+
+def calculate_total_trips(bus_routes_df: pd.DataFrame, *aggregated_od_volume_dfs: pd.DataFrame) -> pd.DataFrame:
+    """
+    Finds the weekday and weekend/holiday trips made between the consecutive stops of every bus service.
+
+    The OD table is indexed on (ORIGIN_PT_CODE, DESTINATION_PT_CODE) once and joined against every
+    segment in one pass. Several months of aggregated OD data can be passed at once; their trips are summed.
+
+    Parameters:
+    - bus_routes_df: DataFrame, the BusRoutes data.
+    - aggregated_od_volume_dfs: DataFrames, one or more outputs of aggregate_od_volume_df.
+
+    Returns:
+    - A DataFrame with one row per segment and WEEKDAY_TOTAL_TRIPS / WEEKEND_TOTAL_TRIPS columns.
+    """
+    segments_df = build_route_segments(bus_routes_df)
+    aggregated_od_volume_df = pd.concat(aggregated_od_volume_dfs, ignore_index=True)
+
+    trips = _trips_by_od_pair(aggregated_od_volume_df, keys=[])
+    trips = trips.reindex(columns=list(DAY_TYPE_COLUMNS), fill_value=0).rename(columns=DAY_TYPE_COLUMNS)
+    trips.columns = list(trips.columns)
+
+    result_df = segments_df.join(trips, on=OD_KEY)
+    for col in DAY_TYPE_COLUMNS.values():
+        result_df[col] = result_df[col].fillna(0).astype('int64')
+
+    return result_df
+
+
+def calculate_monthly_total_trips(bus_routes_df: pd.DataFrame, od_volume_by_month: dict) -> pd.DataFrame:
+    """
+    Finds the weekday and weekend/holiday trips of every bus service, for several months at once.
+
+    Parameters:
+    - bus_routes_df: DataFrame, the BusRoutes data.
+    - od_volume_by_month: dict, maps a month label (e.g. 'Jul24') to the output of aggregate_od_volume_df for that month.
+
+    Returns:
+    - A DataFrame with one row per ServiceNo and {month}_WEEKDAY_TOTAL_TRIPS / {month}_WEEKEND_PH_TOTAL_TRIPS columns.
+    """
+    segments_df = build_route_segments(bus_routes_df)
+    aggregated_od_volume_df = pd.concat(od_volume_by_month, names=['MONTH']).reset_index(level='MONTH')
+
+    trips = _trips_by_od_pair(aggregated_od_volume_df, keys=['MONTH'])
+    month_columns = {
+        'WEEKDAY': '{}_WEEKDAY_TOTAL_TRIPS',
+        'WEEKENDS/HOLIDAY': '{}_WEEKEND_PH_TOTAL_TRIPS',
+    }
+    wanted = pd.MultiIndex.from_product([list(od_volume_by_month), list(month_columns)])
+    trips = trips.reindex(columns=wanted, fill_value=0)
+    trips.columns = [month_columns[day_type].format(month) for month, day_type in trips.columns]
+
+    result_df = segments_df.join(trips, on=OD_KEY)
+    result_df[trips.columns] = result_df[trips.columns].fillna(0).astype('int64')
+
+    return result_df.groupby('ServiceNo', as_index=False)[list(trips.columns)].sum()
+
+
+def group_and_aggregate_trips(df: pd.DataFrame) -> pd.DataFrame:
+    # Group by 'ServiceNo' and 'Direction', and aggregate with sum
+    result = df.groupby(['ServiceNo'], as_index=False).agg(
+        WEEKDAY_TOTAL_TRIPS=('WEEKDAY_TOTAL_TRIPS', 'sum'),
+        WEEKEND_TOTAL_TRIPS=('WEEKEND_TOTAL_TRIPS', 'sum')
+    )
+
+    return result
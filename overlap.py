@@ -0,0 +1,193 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+MRT_COLUMNS = [
+    'NS_MRT_geom', 'EW_MRT_geom', 'DT_MRT_geom', 'CC_MRT_geom', 'NE_MRT_geom', 'TE_MRT_geom'
+]
+
+
+def get_mrt_geometries(gdf, mrt_columns=MRT_COLUMNS):
+    """
+    Takes the MRT line geometries out of a bus/MRT GeoDataFrame. Every row holds the same
+    MRT geometries, so they are read once from the first row.
+
+    Returns:
+    - A GeoSeries of MRT line geometries, indexed by column name.
+    """
+    first_row = gdf.iloc[0]
+    return gpd.GeoSeries([first_row[col] for col in mrt_columns], index=mrt_columns, crs=gdf.crs)
+
+
+def overlap_percentage_matrix(bus_geoms, mrt_geoms):
+    """
+    Computes the share of each bus route's area that lies inside each MRT line's area.
+
+    Parameters:
+    - bus_geoms: array-like of shapely geometries, the buffered bus routes.
+    - mrt_geoms: array-like of shapely geometries, the buffered MRT lines.
+
+    Returns:
+    - A float array of shape (number of bus routes, number of MRT lines) with overlap percentages.
+    """
+    bus_geoms = np.asarray(bus_geoms, dtype=object)
+    mrt_geoms = np.asarray(mrt_geoms, dtype=object)
+    shapely.prepare(mrt_geoms)
+
+    # Only intersect the pairs that touch at all; most routes miss most lines
+    touching = shapely.intersects(bus_geoms[:, None], mrt_geoms[None, :])
+    bus_index, mrt_index = np.nonzero(touching)
+
+    intersection_area = np.zeros(touching.shape)
+    intersection_area[bus_index, mrt_index] = shapely.area(
+        shapely.intersection(bus_geoms[bus_index], mrt_geoms[mrt_index])
+    )
+
+    bus_area = shapely.area(bus_geoms)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(bus_area > 0, intersection_area / bus_area * 100, 0.0)
+
+
+def buffer_routes(route_geoms, buffer_distance):
+    # Routes are in SVY21 (see projection.py), so the buffer distance is in metres
+    return shapely.buffer(np.asarray(route_geoms, dtype=object), buffer_distance)
+
+
+def bus_mrt_overlap(gdf, mrt_geoms, buffer_distance=None, bus_col='buffered_bus_route_geom',
+                    route_col='original_bus_route_geom'):
+    """
+    Overlap percentages of every bus service with every MRT line, as a compact table.
+
+    Parameters:
+    - gdf: GeoDataFrame, one row per bus service, in SVY21.
+    - mrt_geoms: GeoSeries, the MRT line geometries from get_mrt_geometries, in SVY21.
+    - buffer_distance: float, optional. If given, the unbuffered routes in route_col are buffered by
+      this many metres instead of using bus_col, so different buffers can be tried quickly.
+
+    Returns:
+    - A DataFrame indexed by ServiceNo with one overlap percentage column per MRT line.
+    """
+    if buffer_distance is None:
+        bus_geoms = gdf[bus_col].values
+    else:
+        bus_geoms = buffer_routes(gdf[route_col].values, buffer_distance)
+
+    matrix = overlap_percentage_matrix(bus_geoms, mrt_geoms.values)
+    return pd.DataFrame(matrix, index=pd.Index(gdf['ServiceNo'], name='ServiceNo'), columns=mrt_geoms.index)
+
+
+def apply_overlap_calculations(gdf, mrt_columns=MRT_COLUMNS):
+    """
+    Adds the bus/MRT overlap percentages to the GeoDataFrame, in the same layout as the
+    former row-by-row calculation: a ServiceNo column followed by one column per MRT line.
+    """
+    overlap_df = bus_mrt_overlap(gdf, get_mrt_geometries(gdf, mrt_columns)).reset_index()
+    overlap_df.index = gdf.index
+
+    # Concatenate with the original GeoDataFrame
+    return pd.concat([gdf, overlap_df], axis=1)
+
+
+# Number of candidate pairs intersected per task in find_bus_alternatives
+PAIR_CHUNK_SIZE = 2000
+
+# Each worker process receives the route geometries once, as WKB
+_worker_geoms = None
+
+
+def _init_worker(geoms_wkb):
+    global _worker_geoms
+    _worker_geoms = shapely.from_wkb(geoms_wkb)
+
+
+def _intersection_areas(pairs, geoms=None):
+    geoms = geoms if geoms is not None else _worker_geoms
+    left, right = pairs
+    return shapely.area(shapely.intersection(geoms[left], geoms[right]))
+
+
+def bus_overlap_pairs(gdf, bus_col='buffered_bus_route_geom', workers=None):
+    """
+    Finds every pair of bus services whose buffered routes overlap.
+
+    An STRtree on the route bounds prunes the pairs that cannot overlap, so only routes that
+    actually touch are intersected, and those intersections are spread across a process pool.
+
+    Parameters:
+    - gdf: GeoDataFrame, one row per bus service with ServiceNo and the buffered route geometry.
+    - bus_col: str, the column holding the buffered route geometries.
+    - workers: int, optional, number of processes. Defaults to the number of cores.
+
+    Returns:
+    - A DataFrame with ServiceNo, Alternative_Bus and Overlap_Percentage, one row per overlapping pair and
+      direction. The overlap percentage is the share of the service's own area covered by the alternative.
+    """
+    geoms = np.asarray(gdf[bus_col].values, dtype=object)
+    service_numbers = gdf['ServiceNo'].to_numpy()
+
+    tree = shapely.STRtree(geoms)
+    left, right = tree.query(geoms, predicate='intersects')
+    not_self = left != right
+    left, right = left[not_self], right[not_self]
+    print(f"Intersecting {len(left)} candidate pairs out of {len(geoms) * (len(geoms) - 1)}.")
+
+    chunks = [(left[i:i + PAIR_CHUNK_SIZE], right[i:i + PAIR_CHUNK_SIZE]) for i in range(0, len(left), PAIR_CHUNK_SIZE)]
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(chunks) <= 1:
+        areas = [_intersection_areas(chunk, geoms) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shapely.to_wkb(geoms),)) as executor:
+            areas = list(executor.map(_intersection_areas, chunks))
+    intersection_area = np.concatenate(areas) if areas else np.zeros(0)
+
+    bus_area = shapely.area(geoms)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        overlap_percentage = np.where(bus_area[left] > 0, intersection_area / bus_area[left] * 100, 0.0)
+
+    pairs_df = pd.DataFrame({
+        'ServiceNo': service_numbers[left],
+        'Alternative_Bus': service_numbers[right],
+        'Overlap_Percentage': overlap_percentage,
+    })
+    return pairs_df[pairs_df['Overlap_Percentage'] > 0].reset_index(drop=True)
+
+
+def find_bus_alternatives(gdf, k=3, bus_col='buffered_bus_route_geom', workers=None, pairs_df=None):
+    """
+    Finds the k bus services that overlap most with each bus service.
+
+    Parameters:
+    - gdf: GeoDataFrame, one row per bus service with ServiceNo and the buffered route geometry.
+    - k: int, number of alternatives to keep per service.
+    - bus_col: str, the column holding the buffered route geometries.
+    - workers: int, optional, number of processes. Defaults to the number of cores.
+    - pairs_df: DataFrame, optional, the output of bus_overlap_pairs, if it has already been computed.
+
+    Returns:
+    - A DataFrame with ServiceNo and Top_{i}_Alternative_Bus / Top_{i}_Overlap_Percentage for i = 1..k.
+      The overlap percentage is the share of the service's own area covered by the alternative.
+    """
+    service_numbers = gdf['ServiceNo'].to_numpy()
+    if pairs_df is None:
+        pairs_df = bus_overlap_pairs(gdf, bus_col=bus_col, workers=workers)
+    top_df = (
+        pairs_df
+        .sort_values(['ServiceNo', 'Overlap_Percentage'], ascending=[True, False])
+        .groupby('ServiceNo', sort=False)
+        .head(k)
+    )
+    top_df['Rank'] = top_df.groupby('ServiceNo', sort=False).cumcount() + 1
+
+    # One row per service, with the alternatives side by side
+    wide_df = top_df.pivot(index='ServiceNo', columns='Rank', values=['Alternative_Bus', 'Overlap_Percentage'])
+    result_df = pd.DataFrame({'ServiceNo': service_numbers})
+    for rank in range(1, k + 1):
+        for value in ['Alternative_Bus', 'Overlap_Percentage']:
+            column = wide_df[(value, rank)] if (value, rank) in wide_df.columns else pd.Series(dtype=object)
+            result_df[f'Top_{rank}_{value}'] = result_df['ServiceNo'].map(column)
+        result_df[f'Top_{rank}_Overlap_Percentage'] = result_df[f'Top_{rank}_Overlap_Percentage'].astype(float)
+    return result_df
@@ -0,0 +1,117 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from projection import SVY21
+
+# Side of a grid cell, in metres
+GRID_CELL_SIZE = 250
+
+
+def build_population_grid(planning_area_gdf, population_col='population_size', cell_size=GRID_CELL_SIZE):
+    """
+    Spreads the population of each planning area over a square grid, in proportion to the share
+    of the planning area's surface that falls in each cell.
+
+    Parameters:
+    - planning_area_gdf: GeoDataFrame, the planning area polygons in SVY21 (see projection.to_svy21),
+      with their population in population_col.
+    - population_col: str, the population column.
+    - cell_size: float, the side of a cell in metres.
+
+    Returns:
+    - A GeoDataFrame with cell_id, population and the cell polygon, in SVY21. Cells outside every
+      planning area are left out.
+    """
+    areas = np.asarray(planning_area_gdf.geometry.values, dtype=object)
+    population = pd.to_numeric(planning_area_gdf[population_col], errors='coerce').fillna(0).to_numpy(dtype=float)
+
+    min_x, min_y, max_x, max_y = shapely.total_bounds(areas)
+    columns = int(np.ceil((max_x - min_x) / cell_size))
+    rows = int(np.ceil((max_y - min_y) / cell_size))
+    column_index, row_index = np.meshgrid(np.arange(columns), np.arange(rows))
+    column_index, row_index = column_index.ravel(), row_index.ravel()
+    cells = shapely.box(
+        min_x + column_index * cell_size, min_y + row_index * cell_size,
+        min_x + (column_index + 1) * cell_size, min_y + (row_index + 1) * cell_size
+    )
+
+    # Only the cells that touch a planning area are intersected with it
+    cell_index, area_index = shapely.STRtree(areas).query(cells, predicate='intersects')
+    shared_area = shapely.area(shapely.intersection(cells[cell_index], areas[area_index]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = np.where(shapely.area(areas)[area_index] > 0, shared_area / shapely.area(areas)[area_index], 0.0)
+    cell_population = np.bincount(cell_index, weights=share * population[area_index], minlength=len(cells))
+
+    in_grid = np.unique(cell_index)
+    print(f"Spread the population of {len(areas)} planning areas over {len(in_grid)} cells of {cell_size} m.")
+    return gpd.GeoDataFrame({
+        # Cell ids encode the cell's row and column, so they stay the same for the same bounds and cell size
+        'cell_id': (row_index[in_grid].astype(np.int64) * columns + column_index[in_grid]),
+        'population': cell_population[in_grid],
+    }, geometry=cells[in_grid], crs=SVY21)
+
+
+def route_cells(route_gdf, population_grid, route_col='buffered_bus_route_geom'):
+    """
+    Indexes the grid cells each bus route covers. A cell is covered when its centre lies inside the
+    buffered route, so every cell is counted whole or not at all.
+
+    Parameters:
+    - route_gdf: GeoDataFrame, one row per bus service with ServiceNo and the buffered route in SVY21.
+    - population_grid: GeoDataFrame, from build_population_grid.
+    - route_col: str, the column holding the buffered route polygons.
+
+    Returns:
+    - A dict mapping ServiceNo to a sorted array of cell ids.
+    """
+    routes = np.asarray(route_gdf[route_col].values, dtype=object)
+    centres = shapely.centroid(np.asarray(population_grid.geometry.values, dtype=object))
+    route_index, cell_index = shapely.STRtree(centres).query(routes, predicate='contains')
+
+    cell_ids = population_grid['cell_id'].to_numpy()
+    cells_by_route = pd.Series(cell_ids[cell_index]).groupby(route_index).unique()
+    return {
+        service_no: np.sort(np.asarray(cells_by_route.get(position, []), dtype=np.int64))
+        for position, service_no in enumerate(route_gdf['ServiceNo'].astype(str))
+    }
+
+
+def population_served(cells_by_route, population_grid):
+    """
+    Population of the grid cells covered by each bus route.
+
+    Returns:
+    - A Series indexed by ServiceNo.
+    """
+    cell_population = pd.Series(population_grid['population'].to_numpy(), index=population_grid['cell_id'].to_numpy())
+    return pd.Series({
+        service_no: float(cell_population.reindex(cells).sum()) for service_no, cells in cells_by_route.items()
+    }, name='population_served')
+
+
+def covered_population(cells_by_route, population_grid, service_numbers=None):
+    """
+    Population covered by a set of bus routes together. A cell covered by several routes is counted once.
+
+    Parameters:
+    - cells_by_route: dict, from route_cells.
+    - population_grid: GeoDataFrame, from build_population_grid.
+    - service_numbers: iterable of ServiceNo, optional. Defaults to every route.
+    """
+    if service_numbers is None:
+        service_numbers = cells_by_route
+    cell_arrays = [cells_by_route[service_no] for service_no in service_numbers]
+    covered = np.unique(np.concatenate(cell_arrays)) if cell_arrays else np.zeros(0, dtype=np.int64)
+    is_covered = np.isin(population_grid['cell_id'].to_numpy(), covered)
+    return float(population_grid['population'].to_numpy()[is_covered].sum())
+
+
+def grid_cell_units(cells_by_route, population_grid):
+    """
+    Coverage units for scenario.RouteRemovalScenario: the grid cells of each route, instead of
+    whole planning areas (see scenario.planning_area_units).
+    """
+    unit_population = dict(zip(population_grid['cell_id'].tolist(), population_grid['population'].tolist()))
+    return {service_no: cells.tolist() for service_no, cells in cells_by_route.items()}, unit_population
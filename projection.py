@@ -0,0 +1,73 @@
+from functools import cache
+
+import shapely
+from pyproj import CRS, Transformer
+
+# SVY21 / Singapore TM, in metres. All buffers, intersections and areas are computed in this CRS.
+SVY21 = 'EPSG:3414'
+
+# Longitude / latitude, used by the OneMap, OSRM and OpenStreetMap inputs and by Leaflet maps
+WGS84 = 'EPSG:4326'
+
+def to_svy21(gdf, assumed_crs=WGS84):
+    """
+    Projects a GeoDataFrame into SVY21 once, so later steps can work in metres.
+
+    Parameters:
+    - gdf: GeoDataFrame, the data to project.
+    - assumed_crs: str, the CRS to assume when gdf has none set.
+
+    Returns:
+    - The GeoDataFrame in SVY21. All geometry columns are projected, not only the active one.
+    """
+    if gdf.crs is None:
+        gdf = gdf.set_crs(assumed_crs)
+    if CRS(gdf.crs) == CRS(SVY21):
+        return gdf
+    source_crs = gdf.crs
+    gdf = gdf.to_crs(SVY21)
+    for col in gdf.columns:
+        if col != gdf.geometry.name and gdf[col].dtype == 'geometry':
+            gdf[col] = gdf[col].set_crs(source_crs, allow_override=True).to_crs(SVY21)
+    return gdf
+
+
+def buffer_bus_route(bus_mrt_combined_gdf, buffer_distance, new_col="buffered_bus_route_geom"):
+    """
+    Buffers the bus routes in the 'geometry' column by buffer_distance metres.
+
+    Args:
+        bus_mrt_combined_gdf (GeoDataFrame): bus routes in SVY21 (see to_svy21).
+        buffer_distance (float): The distance (in meters) to buffer the geometries.
+
+    Returns:
+        GeoDataFrame: the input with the routes renamed to 'original_bus_route_geom' and the buffered
+        routes in new_col as the active geometry, still in SVY21.
+    """
+    bus_mrt_combined_gdf_buffered = bus_mrt_combined_gdf.copy()
+    bus_mrt_combined_gdf_buffered[new_col] = bus_mrt_combined_gdf_buffered.geometry.buffer(buffer_distance)
+    bus_mrt_combined_gdf_buffered = bus_mrt_combined_gdf_buffered.rename_geometry('original_bus_route_geom')
+    bus_mrt_combined_gdf_buffered = bus_mrt_combined_gdf_buffered.set_geometry(new_col)
+
+    return bus_mrt_combined_gdf_buffered
+
+
+@cache
+def _is_wgs84(crs):
+    return CRS(crs) == CRS(WGS84)
+
+
+@cache
+def _transformer_to_wgs84(crs):
+    # One transformer per source CRS, built on first use
+    return Transformer.from_crs(crs, WGS84, always_xy=True)
+
+
+def to_wgs84(geom, crs=SVY21):
+    """
+    Converts a single geometry from crs to longitude / latitude for display. Geometries that are
+    already in WGS84 (or have no CRS) are returned unchanged.
+    """
+    if geom is None or crs is None or _is_wgs84(crs):
+        return geom
+    return shapely.transform(geom, _transformer_to_wgs84(crs).transform, interleaved=False)
@@ -0,0 +1,280 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import polyline
+import shapely
+from pyproj import Transformer
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+from od_volume import build_route_segments
+
+# Singapore bounding box (min lon, min lat, max lon, max lat), used to clip larger OSM extracts
+SINGAPORE_BBOX = (103.59, 1.15, 104.10, 1.48)
+
+# OSM highway types that buses can drive on
+DRIVABLE_HIGHWAYS = [
+    'motorway', 'motorway_link', 'trunk', 'trunk_link', 'primary', 'primary_link',
+    'secondary', 'secondary_link', 'tertiary', 'tertiary_link', 'unclassified',
+    'residential', 'living_street', 'service', 'road', 'busway',
+]
+
+# Consecutive bus stops are never this far apart by road, so searches stop here (in metres)
+MAX_SEGMENT_DISTANCE = 15000
+
+# Number of origin nodes solved per dijkstra call. Each call allocates two arrays
+# of (chunk size x number of nodes), so this bounds the memory used per worker.
+ORIGIN_CHUNK_SIZE = 16
+
+# Coordinates are projected to SVY21 so that edge weights are in metres
+to_svy21 = Transformer.from_crs("EPSG:4326", "EPSG:3414", always_xy=True)
+
+
+def build_road_graph(osm_path, graph_path):
+    """
+    Builds a directed road graph for Singapore from an OpenStreetMap extract and saves it to disk.
+
+    Parameters:
+    - osm_path: str, path to an .osm.pbf extract covering Singapore (e.g. Geofabrik's malaysia-singapore-brunei).
+    - graph_path: str, where to save the graph (.npz).
+    """
+    print(f"Reading roads from {osm_path}...")
+    roads = gpd.read_file(osm_path, layer='lines', bbox=SINGAPORE_BBOX)
+    roads = roads[roads['highway'].isin(DRIVABLE_HIGHWAYS)].reset_index(drop=True)
+    other_tags = roads['other_tags'].fillna('')
+
+    # Direction of travel: 1 = along the way, -1 = against it, 0 = both ways
+    oneway = np.zeros(len(roads), dtype=np.int8)
+    oneway[other_tags.str.contains('"oneway"=>"(?:yes|true|1)"').to_numpy()] = 1
+    oneway[other_tags.str.contains('"junction"=>"roundabout"').to_numpy()] = 1
+    oneway[roads['highway'].isin(['motorway', 'motorway_link']).to_numpy()] = 1
+    oneway[other_tags.str.contains('"oneway"=>"-1"').to_numpy()] = -1
+
+    # Every vertex of every way, with the index of the way it belongs to
+    lonlat, way_index = shapely.get_coordinates(roads.geometry.values, return_index=True)
+    x, y = to_svy21.transform(lonlat[:, 0], lonlat[:, 1])
+
+    # Ways that cross share the exact same vertex, which becomes a node of the graph
+    node_keys = np.round(np.column_stack([x, y]), 2)
+    unique_keys, first_vertex, node_ids = np.unique(node_keys, axis=0, return_index=True, return_inverse=True)
+    node_ids = node_ids.ravel()
+
+    # Consecutive vertices of the same way form an edge
+    same_way = way_index[:-1] == way_index[1:]
+    start, end = node_ids[:-1][same_way], node_ids[1:][same_way]
+    length = np.hypot(np.diff(x)[same_way], np.diff(y)[same_way])
+    edge_oneway = oneway[way_index[:-1][same_way]]
+
+    forward = edge_oneway >= 0
+    backward = edge_oneway <= 0
+    u = np.concatenate([start[forward], end[backward]])
+    v = np.concatenate([end[forward], start[backward]])
+    w = np.concatenate([length[forward], length[backward]])
+
+    # Keep only the shortest of any parallel edges between the same two nodes
+    order = np.lexsort((w, v, u))
+    u, v, w = u[order], v[order], w[order]
+    keep = np.ones(len(u), dtype=bool)
+    keep[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+    keep &= u != v
+    u, v, w = u[keep], v[keep], np.maximum(w[keep], 0.01)
+
+    n_nodes = len(unique_keys)
+    matrix = csr_matrix((w, (u, v)), shape=(n_nodes, n_nodes))
+    np.savez_compressed(
+        graph_path,
+        lonlat=lonlat[first_vertex],
+        xy=unique_keys,
+        indptr=matrix.indptr,
+        indices=matrix.indices,
+        data=matrix.data,
+    )
+    print(f"Road graph with {n_nodes} nodes and {matrix.nnz} edges saved to {graph_path}.")
+
+
+def load_road_graph(graph_path):
+    stored = np.load(graph_path)
+    n_nodes = len(stored['xy'])
+    return {
+        'lonlat': stored['lonlat'],
+        'xy': stored['xy'],
+        'matrix': csr_matrix((stored['data'], stored['indices'], stored['indptr']), shape=(n_nodes, n_nodes)),
+    }
+
+
+# Each worker process loads the graph once and keeps it for all of its tasks
+_worker_graph = None
+
+
+def _init_worker(graph_path):
+    global _worker_graph
+    _worker_graph = load_road_graph(graph_path)
+
+
+def _route_origin_chunk(tasks, graph=None):
+    # tasks: list of (origin node, [(pair id, target node), ...])
+    graph = graph if graph is not None else _worker_graph
+    origins = [origin for origin, _ in tasks]
+    _, predecessors = dijkstra(
+        graph['matrix'], directed=True, indices=origins,
+        return_predecessors=True, limit=MAX_SEGMENT_DISTANCE,
+    )
+
+    results = []
+    for row, (origin, targets) in enumerate(tasks):
+        for pair_id, target in targets:
+            if target == origin:
+                results.append((pair_id, graph['lonlat'][[origin]]))
+                continue
+            if predecessors[row, target] < 0:
+                # No road path within reach
+                results.append((pair_id, None))
+                continue
+            path = [target]
+            while path[-1] != origin:
+                path.append(predecessors[row, path[-1]])
+            results.append((pair_id, graph['lonlat'][path[::-1]]))
+    return results
+
+
+def route_stop_pairs(stop_pairs_df, graph_path, workers=None, return_unrouted=False):
+    """
+    Finds the road path between many pairs of bus stops.
+
+    Parameters:
+    - stop_pairs_df: DataFrame, one row per stop pair with Origin_Longitude, Origin_Latitude,
+      Destination_Longitude and Destination_Latitude columns.
+    - graph_path: str, the road graph saved by build_road_graph.
+    - workers: int, optional, number of processes to use. Defaults to the number of cores.
+    - return_unrouted: bool, also return the positions of the pairs that had no road path.
+
+    Returns:
+    - A list with one (n, 2) array of (lon, lat) coordinates per row of stop_pairs_df, running from the
+      origin stop to the destination stop.
+    - If return_unrouted, a list of the row positions that were joined by a straight line.
+    """
+    graph = load_road_graph(graph_path)
+
+    # Snap every stop to its nearest road node
+    tree = cKDTree(graph['xy'])
+    ox, oy = to_svy21.transform(stop_pairs_df['Origin_Longitude'].to_numpy(), stop_pairs_df['Origin_Latitude'].to_numpy())
+    dx, dy = to_svy21.transform(stop_pairs_df['Destination_Longitude'].to_numpy(), stop_pairs_df['Destination_Latitude'].to_numpy())
+    _, origin_nodes = tree.query(np.column_stack([ox, oy]))
+    _, destination_nodes = tree.query(np.column_stack([dx, dy]))
+
+    # One shortest-path search per origin node answers every pair that starts there
+    targets_by_origin = {}
+    for pair_id, (origin, destination) in enumerate(zip(origin_nodes, destination_nodes)):
+        targets_by_origin.setdefault(int(origin), []).append((pair_id, int(destination)))
+    tasks = list(targets_by_origin.items())
+    chunks = [tasks[i:i + ORIGIN_CHUNK_SIZE] for i in range(0, len(tasks), ORIGIN_CHUNK_SIZE)]
+
+    workers = workers or os.cpu_count()
+    print(f"Routing {len(stop_pairs_df)} stop pairs from {len(tasks)} origins on {workers} processes...")
+    if workers == 1:
+        chunk_results = [_route_origin_chunk(chunk, graph) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(graph_path,)) as executor:
+            chunk_results = list(executor.map(_route_origin_chunk, chunks, chunksize=4))
+
+    routes = [None] * len(stop_pairs_df)
+    for results in chunk_results:
+        for pair_id, coords in results:
+            routes[pair_id] = coords
+
+    # Start and end each path at the stops themselves. Stops with no road path are joined by a straight line.
+    origin_lonlat = stop_pairs_df[['Origin_Longitude', 'Origin_Latitude']].to_numpy()
+    destination_lonlat = stop_pairs_df[['Destination_Longitude', 'Destination_Latitude']].to_numpy()
+    unrouted = []
+    for pair_id, coords in enumerate(routes):
+        if coords is None:
+            unrouted.append(pair_id)
+            coords = np.empty((0, 2))
+        routes[pair_id] = np.vstack([origin_lonlat[pair_id], coords, destination_lonlat[pair_id]])
+    if unrouted:
+        print(f"Warning: {len(unrouted)} stop pairs had no road path and were joined by a straight line.")
+
+    if return_unrouted:
+        return routes, unrouted
+    return routes
+
+
+def encode_route(coords):
+    # polyline expects (lat, lon) pairs
+    return polyline.encode([(lat, lon) for lon, lat in coords])
+
+
+def get_stop_pairs(bus_routes_df, bus_stops_df):
+    """
+    Lists every consecutive pair of stops of every bus service and direction, with the stop coordinates.
+
+    Parameters:
+    - bus_routes_df: DataFrame, the BusRoutes data.
+    - bus_stops_df: DataFrame, the BusStops data with BusStopCode, Latitude and Longitude.
+
+    Returns:
+    - A DataFrame with ServiceNo, Direction, ORIGIN_PT_CODE, DESTINATION_PT_CODE and the coordinates of both stops.
+    """
+    stop_coords = bus_stops_df[['BusStopCode', 'Longitude', 'Latitude']].drop_duplicates(subset='BusStopCode')
+    segments_df = build_route_segments(bus_routes_df)
+    segments_df = segments_df.merge(
+        stop_coords.rename(columns={'BusStopCode': 'ORIGIN_PT_CODE', 'Longitude': 'Origin_Longitude', 'Latitude': 'Origin_Latitude'}),
+        on='ORIGIN_PT_CODE', how='inner',
+    ).merge(
+        stop_coords.rename(columns={'BusStopCode': 'DESTINATION_PT_CODE', 'Longitude': 'Destination_Longitude', 'Latitude': 'Destination_Latitude'}),
+        on='DESTINATION_PT_CODE', how='inner',
+    )
+    return segments_df
+
+
+def build_encoded_polylines(bus_routes_df, bus_stops_df, graph_path, output_path=None, workers=None):
+    """
+    Routes every bus service along the local road graph, replacing the stop-by-stop OSRM queries.
+
+    Parameters:
+    - bus_routes_df: DataFrame, the BusRoutes data.
+    - bus_stops_df: DataFrame, the BusStops data.
+    - graph_path: str, the road graph saved by build_road_graph.
+    - output_path: str, optional, where to save the result as CSV.
+    - workers: int, optional, number of processes to use.
+
+    Returns:
+    - A DataFrame with ServiceNo, Direction and EncodedPolyline, one row per consecutive stop pair,
+      in the same format as encoded_polylines_output.csv.
+    """
+    segments_df = get_stop_pairs(bus_routes_df, bus_stops_df)
+
+    # Many services share the same stop pairs, so each pair is only routed once
+    stop_pairs_df = segments_df.drop_duplicates(subset=['ORIGIN_PT_CODE', 'DESTINATION_PT_CODE']).reset_index(drop=True)
+    routes = route_stop_pairs(stop_pairs_df, graph_path, workers=workers)
+    stop_pairs_df['EncodedPolyline'] = [encode_route(coords) for coords in routes]
+
+    df_encoded_polylines = segments_df.merge(
+        stop_pairs_df[['ORIGIN_PT_CODE', 'DESTINATION_PT_CODE', 'EncodedPolyline']],
+        on=['ORIGIN_PT_CODE', 'DESTINATION_PT_CODE'], how='left', sort=False,
+    )[['ServiceNo', 'Direction', 'EncodedPolyline']]
+
+    if output_path:
+        df_encoded_polylines.to_csv(output_path, index=False)
+        print(f"Encoded polylines saved to {output_path}.")
+    return df_encoded_polylines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Route every bus service on a local copy of the Singapore road network.")
+    parser.add_argument('--osm', help="OpenStreetMap .osm.pbf extract to build the road graph from")
+    parser.add_argument('--graph', default='data/road_graph.npz', help="road graph file to build or use")
+    parser.add_argument('--output', default='data/encoded_polylines_output.csv')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.osm:
+        build_road_graph(args.osm, args.graph)
+    bus_routes_df = pd.read_parquet('data/bus_routes_data.parquet')
+    bus_stops_df = pd.read_parquet('data/bus_stops_data.parquet')
+    build_encoded_polylines(bus_routes_df, bus_stops_df, args.graph, args.output, workers=args.workers)
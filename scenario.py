@@ -0,0 +1,286 @@
+import ast
+import re
+
+import numpy as np
+import pandas as pd
+
+# Weights of the default objective used by greedy_search and beam_search (see removal_score)
+SCORE_WEIGHTS = {
+    'mrt_overlap': 1.0,             # per percentage point of MRT overlap of the removed services
+    'stranded_stops': 100.0,        # per bus stop left without any bus service
+    'population_lost': 1 / 1000,    # per resident no longer covered by any bus service
+    'unmatched_services': 50.0,     # per removed service without a remaining alternative
+}
+
+# A removed service counts as matched if a remaining service covers at least this share of its route
+MIN_ALTERNATIVE_OVERLAP = 50.0
+
+
+def overlap_pairs_from_alternatives(all_bus_overlaps_df):
+    """
+    Turns the Top_{i}_Alternative_Bus / Top_{i}_Overlap_Percentage columns of all_bus_overlaps into
+    one row per (ServiceNo, Alternative_Bus) pair, like overlap.bus_overlap_pairs.
+    """
+    ranks = sorted(
+        int(col.split('_')[1]) for col in all_bus_overlaps_df.columns
+        if col.startswith('Top_') and col.endswith('_Alternative_Bus')
+    )
+    pairs = [
+        all_bus_overlaps_df[['ServiceNo', f'Top_{rank}_Alternative_Bus', f'Top_{rank}_Overlap_Percentage']]
+        .set_axis(['ServiceNo', 'Alternative_Bus', 'Overlap_Percentage'], axis=1)
+        for rank in ranks
+    ]
+    pairs_df = pd.concat(pairs, ignore_index=True).dropna(subset=['Alternative_Bus'])
+    pairs_df['ServiceNo'] = pairs_df['ServiceNo'].astype(str)
+    pairs_df['Alternative_Bus'] = pairs_df['Alternative_Bus'].astype(str)
+    return pairs_df
+
+
+def planning_area_units(population_served_df, area_population):
+    """
+    Coverage units from the population_served feature: each planning area a service passes through.
+
+    Parameters:
+    - population_served_df: DataFrame with ServiceNo and planning_areas, a list (or its string form, as saved
+      in data/categorised_bus_mrt_combined_gdf_overlap_with_planning_areas.csv).
+    - area_population: dict, maps a lowercase planning area name to its population.
+
+    Returns:
+    - service_units: dict, maps ServiceNo to the planning areas it covers.
+    - unit_population: dict, maps each planning area to its population.
+    """
+    service_units = {}
+    for service_no, areas in zip(population_served_df['ServiceNo'].astype(str), population_served_df['planning_areas']):
+        if isinstance(areas, str):
+            try:
+                areas = ast.literal_eval(areas)
+            except ValueError:
+                # Services that touch no planning area were saved as "[nan]"; keep the quoted names only
+                areas = re.findall(r"'([^']*)'", areas)
+        if not isinstance(areas, (list, tuple, np.ndarray)):
+            areas = []
+        service_units[service_no] = [area.lower() for area in areas if isinstance(area, str)]
+    return service_units, dict(area_population)
+
+
+class RouteRemovalScenario:
+    """
+    Evaluates what happens when a set of bus services is removed, updating only what the removed services touch.
+
+    Removing a service decrements the service counts of its own stops and coverage units, and re-ranks the
+    alternatives only of removed services whose best alternative it was. Every change can be undone, so a
+    search can try thousands of removal sets from one engine without rebuilding anything.
+    """
+
+    def __init__(self, bus_routes_df, pairs_df, service_units, unit_population, mrt_overlap=None,
+                 min_alternative_overlap=MIN_ALTERNATIVE_OVERLAP):
+        """
+        Parameters:
+        - bus_routes_df: DataFrame, the BusRoutes data with ServiceNo and BusStopCode.
+        - pairs_df: DataFrame, from overlap.bus_overlap_pairs or overlap_pairs_from_alternatives.
+        - service_units, unit_population: dicts, the coverage units of every service and the population of
+          every unit (see planning_area_units). Units covered by no remaining service count as lost.
+        - mrt_overlap: Series, optional, the MRT overlap percentage of each service, indexed by ServiceNo.
+        - min_alternative_overlap: float, see MIN_ALTERNATIVE_OVERLAP.
+        """
+        self.min_alternative_overlap = min_alternative_overlap
+        services = sorted(
+            set(bus_routes_df['ServiceNo'].astype(str)) | set(service_units) | set(pairs_df['ServiceNo'].astype(str))
+        )
+        self.services = services
+
+        # Stops and coverage units are numbered, so each service holds an integer array of the ones it serves
+        stop_codes, stop_index = np.unique(bus_routes_df['BusStopCode'].to_numpy(), return_inverse=True)
+        stops_by_service = pd.Series(stop_index).groupby(bus_routes_df['ServiceNo'].astype(str).to_numpy()).unique()
+        self.service_stops = {
+            service_no: np.asarray(stops_by_service.get(service_no, []), dtype=np.int64) for service_no in services
+        }
+        self.stop_counts = np.zeros(len(stop_codes), dtype=np.int64)
+        for stops in self.service_stops.values():
+            self.stop_counts[stops] += 1
+
+        units = sorted({unit for unit_ids in service_units.values() for unit in unit_ids} | set(unit_population))
+        unit_position = {unit: position for position, unit in enumerate(units)}
+        self.unit_population = np.array([unit_population.get(unit, 0) for unit in units], dtype=float)
+        self.service_units = {
+            service_no: np.unique(np.array([unit_position[unit] for unit in service_units.get(service_no, [])], dtype=np.int64))
+            for service_no in services
+        }
+        self.unit_counts = np.zeros(len(units), dtype=np.int64)
+        for unit_ids in self.service_units.values():
+            self.unit_counts[unit_ids] += 1
+
+        # Alternatives of each service, best first, and the services that list each alternative
+        ordered_df = pairs_df.sort_values(['ServiceNo', 'Overlap_Percentage'], ascending=[True, False])
+        self.alternatives = {service_no: [] for service_no in services}
+        self.listed_by = {service_no: set() for service_no in services}
+        for service_no, alternative, percentage in zip(
+            ordered_df['ServiceNo'].astype(str), ordered_df['Alternative_Bus'].astype(str), ordered_df['Overlap_Percentage']
+        ):
+            self.alternatives.setdefault(service_no, []).append((alternative, float(percentage)))
+            self.listed_by.setdefault(alternative, set()).add(service_no)
+
+        self.mrt_overlap = {} if mrt_overlap is None else {str(key): float(value) for key, value in mrt_overlap.items()}
+
+        self.removed = set()
+        self.best_alternative = {}
+        self.stranded_stops = 0
+        self.population_lost = 0.0
+        self.mrt_overlap_removed = 0.0
+
+    def _find_best_alternative(self, service_no):
+        for alternative, percentage in self.alternatives.get(service_no, []):
+            if alternative not in self.removed:
+                return alternative, percentage
+        return None, 0.0
+
+    def remove(self, service_no):
+        """
+        Removes one bus service. Does nothing if it is already removed.
+        """
+        if service_no in self.removed:
+            return
+        self.removed.add(service_no)
+
+        stops = self.service_stops.get(service_no, np.zeros(0, dtype=np.int64))
+        self.stop_counts[stops] -= 1
+        self.stranded_stops += int(np.count_nonzero(self.stop_counts[stops] == 0))
+
+        unit_ids = self.service_units.get(service_no, np.zeros(0, dtype=np.int64))
+        self.unit_counts[unit_ids] -= 1
+        self.population_lost += float(self.unit_population[unit_ids][self.unit_counts[unit_ids] == 0].sum())
+
+        self.mrt_overlap_removed += self.mrt_overlap.get(service_no, 0.0)
+
+        # Only removed services that relied on this one need a new alternative
+        for other in self.listed_by.get(service_no, set()) & self.removed:
+            if self.best_alternative[other][0] == service_no:
+                self.best_alternative[other] = self._find_best_alternative(other)
+        self.best_alternative[service_no] = self._find_best_alternative(service_no)
+
+    def restore(self, service_no):
+        """
+        Undoes remove for one bus service. Does nothing if it is not removed.
+        """
+        if service_no not in self.removed:
+            return
+        self.removed.discard(service_no)
+        del self.best_alternative[service_no]
+
+        stops = self.service_stops.get(service_no, np.zeros(0, dtype=np.int64))
+        self.stranded_stops -= int(np.count_nonzero(self.stop_counts[stops] == 0))
+        self.stop_counts[stops] += 1
+
+        unit_ids = self.service_units.get(service_no, np.zeros(0, dtype=np.int64))
+        self.population_lost -= float(self.unit_population[unit_ids][self.unit_counts[unit_ids] == 0].sum())
+        self.unit_counts[unit_ids] += 1
+
+        self.mrt_overlap_removed -= self.mrt_overlap.get(service_no, 0.0)
+
+        # The restored service may now be a better alternative for removed services that list it
+        for other in self.listed_by.get(service_no, set()) & self.removed:
+            self.best_alternative[other] = self._find_best_alternative(other)
+
+    def set_removed(self, service_numbers):
+        """
+        Moves the engine to exactly this removal set, only touching the services that differ from the current one.
+        """
+        service_numbers = set(service_numbers)
+        for service_no in self.removed - service_numbers:
+            self.restore(service_no)
+        for service_no in service_numbers - self.removed:
+            self.remove(service_no)
+
+    def metrics(self):
+        """
+        Summarises the current removal set.
+
+        Returns:
+        - A dict with removed, stranded_stops, population_lost, mrt_overlap, unmatched_services and
+          mean_alternative_overlap.
+        """
+        alternative_overlaps = [percentage for _, percentage in self.best_alternative.values()]
+        return {
+            'removed': len(self.removed),
+            'stranded_stops': self.stranded_stops,
+            'population_lost': self.population_lost,
+            'mrt_overlap': self.mrt_overlap_removed,
+            'unmatched_services': sum(percentage < self.min_alternative_overlap for percentage in alternative_overlaps),
+            'mean_alternative_overlap': float(np.mean(alternative_overlaps)) if alternative_overlaps else 0.0,
+        }
+
+    def evaluate(self, service_numbers):
+        """
+        Returns the metrics of a removal set, leaving the engine as it was.
+        """
+        previous = set(self.removed)
+        self.set_removed(service_numbers)
+        result = self.metrics()
+        self.set_removed(previous)
+        return result
+
+    def alternatives_of(self, service_no, k=3):
+        # The k best alternatives of a service that are not removed
+        return [(alternative, percentage) for alternative, percentage in self.alternatives.get(service_no, [])
+                if alternative not in self.removed][:k]
+
+
+def removal_score(metrics, weights=SCORE_WEIGHTS):
+    """
+    Default objective of the searches: rewards removing services that run parallel to MRT lines and
+    penalises stranded stops, lost population and removed services left without an alternative.
+    """
+    return (
+        weights['mrt_overlap'] * metrics['mrt_overlap']
+        - weights['stranded_stops'] * metrics['stranded_stops']
+        - weights['population_lost'] * metrics['population_lost']
+        - weights['unmatched_services'] * metrics['unmatched_services']
+    )
+
+
+def beam_search(engine, candidates, n, beam_width=5, score=removal_score):
+    """
+    Searches for the best set of n services to remove, keeping the beam_width best partial sets at each step.
+
+    Parameters:
+    - engine: RouteRemovalScenario.
+    - candidates: iterable of ServiceNo, the services that may be removed.
+    - n: int, the number of services to remove.
+    - beam_width: int, the number of partial sets kept per step. 1 is a greedy search.
+    - score: callable, maps the metrics of a removal set to a number to maximise.
+
+    Returns:
+    - A list of (score, removal set as a sorted list, metrics), best first.
+    """
+    candidates = list(dict.fromkeys(candidates))
+    start = set(engine.removed)
+    beam = [(score(engine.metrics()), frozenset(), engine.metrics())]
+    for _ in range(n):
+        scored = {}
+        for _, removal_set, _ in beam:
+            engine.set_removed(removal_set)
+            for service_no in candidates:
+                if service_no in removal_set:
+                    continue
+                next_set = removal_set | {service_no}
+                if next_set in scored:
+                    continue
+                engine.remove(service_no)
+                result = engine.metrics()
+                scored[next_set] = (score(result), next_set, result)
+                engine.restore(service_no)
+        if not scored:
+            break
+        beam = sorted(scored.values(), key=lambda item: item[0], reverse=True)[:beam_width]
+    engine.set_removed(start)
+    return [(value, sorted(removal_set), result) for value, removal_set, result in beam]
+
+
+def greedy_search(engine, candidates, n, score=removal_score):
+    """
+    Removes the best next service n times (beam_search with a beam of 1).
+
+    Returns:
+    - (score, removal set as a sorted list, metrics).
+    """
+    return beam_search(engine, candidates, n, beam_width=1, score=score)[0]
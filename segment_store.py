@@ -0,0 +1,154 @@
+import hashlib
+import os
+import pickle
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.ops import linemerge
+
+from road_router import get_stop_pairs, route_stop_pairs
+
+# Decoded road paths between consecutive bus stops, keyed by segment id
+segment_store_path = 'data/segment_store.pkl'
+
+# Which segments make up each bus service and direction, in order
+service_segments_path = 'data/service_segments.csv'
+
+
+def segment_id(origin_code, destination_code, origin_lonlat, destination_lonlat):
+    """
+    Content address of a stop-to-stop segment. A segment keeps its id as long as both stops keep
+    their codes and locations, so it is shared by every service that drives between them and
+    survives month-to-month BusRoutes refreshes.
+    """
+    key = "{}|{}|{:.6f},{:.6f}|{:.6f},{:.6f}".format(
+        origin_code, destination_code, *origin_lonlat, *destination_lonlat
+    )
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def road_graph_id(graph_path):
+    """
+    Fingerprint of the road graph file. Segments routed on a different graph (e.g. one built from an
+    older OSM extract) are not reused.
+    """
+    digest = hashlib.sha1()
+    with open(graph_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def load_segment_store(path=segment_store_path):
+    """
+    Returns:
+    - A dict with graph_id (the road graph the segments were routed on), segments (maps segment_id to
+      its coordinates) and unrouted (the segment ids joined by a straight line for lack of a road path).
+    """
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            stored = pickle.load(f)
+        if 'segments' in stored:
+            return stored
+        print(f"{path} does not record its road graph, routing every segment again.")
+    return {'graph_id': None, 'segments': {}, 'unrouted': set()}
+
+
+def save_segment_store(stored, path=segment_store_path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(stored, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def update_segment_store(bus_routes_df, bus_stops_df, graph_path, store_path=segment_store_path,
+                         references_path=service_segments_path, prune=False, workers=None):
+    """
+    Makes sure every stop-to-stop segment of the current bus routes is in the segment store.
+    Only segments that are new, whose stops have moved or that had no road path last time are routed.
+    If the road graph has changed, every segment is routed again.
+
+    Parameters:
+    - bus_routes_df: DataFrame, the BusRoutes data.
+    - bus_stops_df: DataFrame, the BusStops data.
+    - graph_path: str, the road graph saved by road_router.build_road_graph.
+    - store_path: str, the segment store file.
+    - references_path: str, where to save the service-to-segment references as CSV.
+    - prune: bool, drop stored segments that no current service uses.
+    - workers: int, optional, number of processes used for routing.
+
+    Returns:
+    - service_segments_df: DataFrame with ServiceNo, Direction, SegmentSequence and segment_id.
+    - store: dict, maps segment_id to an (n, 2) array of (lon, lat) coordinates.
+    """
+    segments_df = get_stop_pairs(bus_routes_df, bus_stops_df)
+    segments_df['segment_id'] = [
+        segment_id(o, d, (olon, olat), (dlon, dlat))
+        for o, d, olon, olat, dlon, dlat in zip(
+            segments_df['ORIGIN_PT_CODE'], segments_df['DESTINATION_PT_CODE'],
+            segments_df['Origin_Longitude'], segments_df['Origin_Latitude'],
+            segments_df['Destination_Longitude'], segments_df['Destination_Latitude'],
+        )
+    ]
+    segments_df['SegmentSequence'] = segments_df.groupby(['ServiceNo', 'Direction']).cumcount() + 1
+
+    stored = load_segment_store(store_path)
+    graph_id = road_graph_id(graph_path)
+    if stored['graph_id'] != graph_id:
+        if stored['segments']:
+            print(f"The road graph has changed since {store_path} was built, routing every segment again.")
+        stored = {'graph_id': graph_id, 'segments': {}, 'unrouted': set()}
+    store = stored['segments']
+
+    # Straight-line fallbacks are never final: there are few of them, so they are routed again on every update
+    # and replaced as soon as the router (or its MAX_SEGMENT_DISTANCE) finds a road path
+    routed = set(store) - stored['unrouted']
+    missing_df = segments_df[~segments_df['segment_id'].isin(routed)].drop_duplicates(subset='segment_id').reset_index(drop=True)
+    print(f"{segments_df['segment_id'].nunique()} distinct segments, {len(missing_df)} to route.")
+
+    if not missing_df.empty:
+        routes, unrouted = route_stop_pairs(missing_df, graph_path, workers=workers, return_unrouted=True)
+        store.update(zip(missing_df['segment_id'], routes))
+        stored['unrouted'] -= set(missing_df['segment_id'])
+        stored['unrouted'] |= set(missing_df['segment_id'].iloc[unrouted])
+
+    if prune:
+        used = set(segments_df['segment_id'])
+        store = stored['segments'] = {key: coords for key, coords in store.items() if key in used}
+        stored['unrouted'] &= used
+
+    if not missing_df.empty or prune:
+        save_segment_store(stored, store_path)
+
+    service_segments_df = segments_df[['ServiceNo', 'Direction', 'SegmentSequence', 'segment_id']]
+    if references_path:
+        service_segments_df.to_csv(references_path, index=False)
+    return service_segments_df, store
+
+
+def assemble_service_geometries(service_segments_df, store):
+    """
+    Builds one merged route geometry per bus service from its segment references.
+
+    Parameters:
+    - service_segments_df: DataFrame, the references returned by update_segment_store.
+    - store: dict, the segment store.
+
+    Returns:
+    - A GeoDataFrame with ServiceNo and geometry (EPSG:4326), like df_bus_combined_geometry.
+    """
+    # Each distinct segment becomes one LineString, shared by every service that uses it.
+    # Segments have different numbers of points, so each line is built from its own coordinates.
+    segment_ids = service_segments_df['segment_id'].unique()
+    lines = {key: shapely.linestrings(np.asarray(store[key])) for key in segment_ids}
+
+    ordered_df = service_segments_df.sort_values(by=['ServiceNo', 'Direction', 'SegmentSequence'])
+    grouped = ordered_df.groupby('ServiceNo', sort=True)['segment_id']
+    service_numbers = []
+    geometries = []
+    for service_no, ids in grouped:
+        service_numbers.append(service_no)
+        geometries.append(linemerge(shapely.multilinestrings([lines[key] for key in ids])))
+
+    return gpd.GeoDataFrame({'ServiceNo': service_numbers, 'geometry': geometries}, geometry='geometry', crs='EPSG:4326')
@@ -0,0 +1,82 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
+
+# Station names resolved on earlier runs, so only names that have not been seen before are scored again
+station_alias_path = 'data/station_aliases.csv'
+
+ALIAS_COLUMNS = ['name', 'matched_name', 'score', 'candidates_id']
+
+
+def candidates_id(candidates):
+    """
+    Fingerprint of the list of names matched against. Aliases resolved against a different list
+    (e.g. after the Wikipedia station table changes) are not reused.
+    """
+    return hashlib.sha1('\n'.join(sorted(candidates)).encode('utf-8')).hexdigest()[:16]
+
+
+def load_station_aliases(path=station_alias_path):
+    if os.path.exists(path):
+        return pd.read_csv(path, dtype={'name': str, 'matched_name': str, 'candidates_id': str}, keep_default_na=False)
+    return pd.DataFrame(columns=ALIAS_COLUMNS)
+
+
+def save_station_aliases(aliases_df, path=station_alias_path):
+    tmp_path = path + '.tmp'
+    aliases_df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def resolve_station_names(names, candidates, threshold=50, alias_path=station_alias_path, workers=-1):
+    """
+    Finds the closest candidate for every station name, like process.extractOne with fuzz.token_sort_ratio.
+
+    Names already in the alias table are looked up. All other names are scored against every candidate
+    in one process.cdist call spread across cores, and the results are added to the alias table.
+
+    Parameters:
+    - names: iterable of str, the station names to resolve, already cleaned and lowercased.
+    - candidates: list of str, the names to match against, lowercased.
+    - threshold: float, the lowest score accepted as a match.
+    - alias_path: str, the alias table file. None to neither read nor save it.
+    - workers: int, number of threads used by process.cdist, -1 for all cores.
+
+    Returns:
+    - A list with the matched candidate of every name, or None where no candidate scores at least threshold.
+    """
+    names = list(names)
+    candidates = list(candidates)
+    current_id = candidates_id(candidates)
+
+    aliases_df = load_station_aliases(alias_path) if alias_path else pd.DataFrame(columns=ALIAS_COLUMNS)
+    known_df = aliases_df[aliases_df['candidates_id'] == current_id]
+    scores = dict(zip(known_df['name'], known_df['score'].astype(float)))
+    matches = dict(zip(known_df['name'], known_df['matched_name']))
+
+    unseen = list(dict.fromkeys(name for name in names if name not in matches))
+    if unseen and candidates:
+        score_matrix = process.cdist(unseen, candidates, scorer=fuzz.token_sort_ratio, workers=workers)
+        # argmax keeps the first of equally good candidates, as extractOne does
+        best = np.argmax(score_matrix, axis=1)
+        best_scores = score_matrix[np.arange(len(unseen)), best]
+        for name, index, score in zip(unseen, best, best_scores):
+            matches[name] = candidates[index]
+            scores[name] = float(score)
+    print(f"Resolved {len(set(names))} station names, {len(unseen)} of them not seen before.")
+
+    if alias_path and unseen and candidates:
+        new_df = pd.DataFrame({
+            'name': unseen,
+            'matched_name': [matches[name] for name in unseen],
+            'score': [scores[name] for name in unseen],
+            'candidates_id': current_id,
+        })
+        if not aliases_df.empty:
+            new_df = pd.concat([aliases_df, new_df], ignore_index=True)
+        save_station_aliases(new_df, alias_path)
+
+    return [matches[name] if scores.get(name, -1) >= threshold else None for name in names]